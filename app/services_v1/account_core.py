@@ -0,0 +1,175 @@
+"""
+Account-scoped execution for SQL agent queries
+"""
+
+import os
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# --- Account Scope Settings ---
+ACCOUNT_SCOPE_CONFIG = {
+    # optional: scope queries to the request's account_id when it has one
+    # required: refuse trading-data queries without an account_id
+    # off: never scope
+    "mode": os.getenv("SQL_ACCOUNT_SCOPE", "optional").lower(),
+    # Per-statement limit for building the indexes, in place of the pool's 3s command_timeout
+    "index_build_timeout_seconds": float(os.getenv("SQL_ACCOUNT_INDEX_BUILD_TIMEOUT_SECONDS", "3600"))
+}
+
+# Tables holding per-account rows; every reference to them is filtered to the current account
+SCOPED_TABLES = ["forex_trades", "forex_trades_daily", "forex_trades_monthly"]
+
+# Covering indexes for account-scoped queries (rollup primary keys already lead with "Account_ID")
+ACCOUNT_INDEXES = {
+    "idx_account_date": '("Account_ID", "Trade_Date") INCLUDE ("Daily_PnL", "Symbol")',
+    "idx_account_symbol": '("Account_ID", "Symbol", "Trade_Date") INCLUDE ("Daily_PnL")'
+}
+
+CURRENT_ACCOUNT: ContextVar[Optional[str]] = ContextVar("current_account", default=None)
+
+_TOKEN = re.compile(r"""--[^\n]*|/\*|'(?:[^']|'')*'|"(?:[^"]|"")*"|\$\d+|\w+|\s+|.""", re.DOTALL)
+# Functions that run SQL given as text, which a rewrite of the statement itself can't reach
+_DYNAMIC_SQL = re.compile(
+    r"\b(query_to_xml\w*|table_to_xml\w*|cursor_to_xml\w*|schema_to_xml\w*|database_to_xml\w*"
+    r"|dblink\w*|ts_stat|pg_read_\w+|lo_\w+)\s*\(",
+    re.IGNORECASE
+)
+# Words that can follow a table reference without being its alias
+_NOT_ALIAS = {
+    "where", "group", "order", "having", "limit", "offset", "fetch", "join", "inner", "left", "right",
+    "full", "cross", "natural", "on", "using", "union", "intersect", "except", "window", "for", "tablesample"
+}
+
+
+class AccountScopeError(Exception):
+    """Raised when a query can't be run within the request's account scope."""
+
+
+@contextmanager
+def account_scope(account_id: Optional[str]):
+    """Scope SQL agent queries run inside the block to account_id."""
+    token = CURRENT_ACCOUNT.set(account_id or None)
+    try:
+        yield
+    finally:
+        CURRENT_ACCOUNT.reset(token)
+
+
+def current_account() -> Optional[str]:
+    """The account queries must be scoped to, or None when they run unscoped."""
+    mode = ACCOUNT_SCOPE_CONFIG["mode"]
+    if mode == "off":
+        return None
+    account = CURRENT_ACCOUNT.get()
+    if account is None and mode == "required":
+        raise AccountScopeError("ACCOUNT_REQUIRED: Trading data can only be queried for a signed-in account.")
+    return account
+
+
+def _table_name(token: str) -> Optional[str]:
+    if token.startswith('"'):
+        name = token[1:-1]
+    elif token[0].isalpha() or token[0] == "_":
+        name = token.lower()
+    else:
+        return None
+    return name if name in SCOPED_TABLES else None
+
+
+def scope_sql(sql: str, param: int) -> str:
+    """Rewrite sql so every scoped table only yields rows of account parameter $param.
+
+    Each reference such as FROM forex_trades f becomes
+    FROM (SELECT * FROM forex_trades WHERE "Account_ID" = $param) f, which
+    Postgres flattens back into an index scan on ("Account_ID", ...).
+    Qualified column references (forex_trades."Symbol") are left alone, and
+    SQL that could read the tables some other way, or whose tokens can't be
+    told apart reliably (comments, escape strings, dollar quoting), is refused.
+    """
+    if _DYNAMIC_SQL.search(sql):
+        raise AccountScopeError("SECURITY_VIOLATION: Dynamic SQL functions are not allowed.")
+
+    tokens = _TOKEN.findall(sql)
+    significant = [i for i, token in enumerate(tokens) if not token.isspace()]
+    position = {index: n for n, index in enumerate(significant)}
+
+    def neighbour(index: int, step: int) -> str:
+        n = position[index] + step
+        return tokens[significant[n]] if 0 <= n < len(significant) else ""
+
+    for index in significant:
+        token = tokens[index]
+        # Comments, escape strings (E'\''), Unicode escapes (U&"...") and dollar quoting hide
+        # where a literal ends from this tokenizer, and with it any table reference after it
+        if token.startswith("--") or token == "/*":
+            raise AccountScopeError("SECURITY_VIOLATION: SQL comments are not allowed.")
+        if token == "$":
+            raise AccountScopeError("SECURITY_VIOLATION: Dollar-quoted strings are not allowed.")
+        if token[0] in "'\"" and index and (
+            tokens[index - 1].lower() == "e" or (tokens[index - 1] == "&" and index > 1 and tokens[index - 2].lower() == "u")
+        ):
+            raise AccountScopeError("SECURITY_VIOLATION: Escape strings and Unicode escapes are not allowed.")
+        if token.startswith("'"):
+            for table in SCOPED_TABLES:
+                if table in token.lower():
+                    raise AccountScopeError(f"SECURITY_VIOLATION: '{table}' may not appear in a string literal.")
+            continue
+
+        table = _table_name(token)
+        if table is None or neighbour(index, 1) == ".":
+            continue
+
+        # Drop a schema qualifier: public.forex_trades
+        if neighbour(index, -1) == ".":
+            dot = significant[position[index] - 1]
+            tokens[dot] = ""
+            tokens[significant[position[index] - 2]] = ""
+
+        following = neighbour(index, 1).lower()
+        has_alias = following == "as" or (re.match(r"^(\w+|\".*\")$", following) and following not in _NOT_ALIAS)
+        subquery = f'(SELECT * FROM {table} WHERE "Account_ID" = ${param})'
+        tokens[index] = subquery if has_alias else f"{subquery} AS {table}"
+
+    return "".join(tokens)
+
+
+async def ensure_account_indexes(pool):
+    """Build the account covering indexes without blocking writes.
+
+    Only one worker builds at a time (the others skip); CREATE INDEX
+    CONCURRENTLY can't run in a transaction, so a session advisory lock is
+    used instead of a transaction lock. A build that failed part way leaves
+    an INVALID index behind, which is dropped and built again.
+    """
+    if ACCOUNT_SCOPE_CONFIG["mode"] == "off":
+        return
+
+    timeout = ACCOUNT_SCOPE_CONFIG["index_build_timeout_seconds"]
+    async with pool.acquire() as conn:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext('forex_trades_account_indexes'))"):
+            return
+        try:
+            # A partitioned forex_trades (see partition_forex_trades.sql) already has them,
+            # and can't take CONCURRENTLY at all
+            if await conn.fetchval("SELECT relkind FROM pg_class WHERE oid = 'forex_trades'::regclass") == "p":
+                return
+            valid = {
+                row["relname"]: row["indisvalid"] for row in await conn.fetch(
+                    """
+                    SELECT c.relname, i.indisvalid FROM pg_index i
+                    JOIN pg_class c ON c.oid = i.indexrelid
+                    WHERE i.indrelid = 'forex_trades'::regclass
+                    """
+                )
+            }
+            for name, definition in ACCOUNT_INDEXES.items():
+                if valid.get(name):
+                    continue
+                if name in valid:
+                    print(f"⚠️ Rebuilding invalid index {name}")
+                    await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}", timeout=timeout)
+                await conn.execute(f"CREATE INDEX CONCURRENTLY {name} ON forex_trades {definition}", timeout=timeout)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtext('forex_trades_account_indexes'))")
@@ -0,0 +1,115 @@
+"""
+Admission control for agent runs that call the upstream LLM
+"""
+
+import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Any
+
+# --- Admission Settings (per worker) ---
+ADMISSION_CONFIG = {
+    "max_in_flight": int(os.getenv("MAX_IN_FLIGHT_QUERIES", "8")),
+    "max_queued": int(os.getenv("MAX_QUEUED_QUERIES", "16")),
+    "max_queue_wait_seconds": float(os.getenv("MAX_QUEUE_WAIT_SECONDS", "15"))
+}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request can't be admitted; callers answer 503 with retry_after."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionSlot:
+    """One admitted request; release is idempotent."""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release()
+
+
+class AdmissionController:
+    """Bound concurrent agent runs with a short, bounded wait queue.
+
+    At most max_in_flight runs execute at once. Further requests wait in
+    line, up to max_queued of them; when the line is full a request is
+    rejected immediately, and a request that waits longer than
+    max_queue_wait_seconds is rejected too, so overload shows up as fast
+    503s instead of every request timing out.
+    """
+
+    def __init__(self, max_in_flight: int = None, max_queued: int = None, max_queue_wait_seconds: float = None):
+        self.max_in_flight = max_in_flight or ADMISSION_CONFIG["max_in_flight"]
+        self.max_queued = max_queued if max_queued is not None else ADMISSION_CONFIG["max_queued"]
+        self.max_queue_wait_seconds = max_queue_wait_seconds or ADMISSION_CONFIG["max_queue_wait_seconds"]
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._in_flight = 0
+        self._queued = 0
+        self._stats = {
+            "admitted": 0, "rejected_queue_full": 0, "rejected_timeout": 0,
+            "total_queue_wait_ms": 0.0, "max_queue_wait_ms": 0.0
+        }
+
+    def _retry_after(self) -> int:
+        return max(1, int(self.max_queue_wait_seconds))
+
+    async def acquire(self) -> AdmissionSlot:
+        """Wait for a run slot, or raise AdmissionRejected."""
+        # _queued also counts requests about to take a free slot, so compare against the total capacity
+        if self._in_flight + self._queued >= self.max_in_flight + self.max_queued:
+            self._stats["rejected_queue_full"] += 1
+            raise AdmissionRejected("Server is busy, please retry shortly", self._retry_after())
+
+        start = time.perf_counter()
+        self._queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_queue_wait_seconds)
+        except asyncio.TimeoutError:
+            self._stats["rejected_timeout"] += 1
+            raise AdmissionRejected("Server is busy, please retry shortly", self._retry_after())
+        finally:
+            self._queued -= 1
+
+        wait_ms = (time.perf_counter() - start) * 1000
+        self._in_flight += 1
+        self._stats["admitted"] += 1
+        self._stats["total_queue_wait_ms"] += wait_ms
+        self._stats["max_queue_wait_ms"] = max(self._stats["max_queue_wait_ms"], wait_ms)
+        return AdmissionSlot(self)
+
+    def _release(self):
+        self._in_flight -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold a run slot for the duration of the block."""
+        admitted = await self.acquire()
+        try:
+            yield admitted
+        finally:
+            admitted.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Admission counters, current load and queue-wait times."""
+        admitted = self._stats["admitted"]
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_queued": self.max_queued,
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "admitted": admitted,
+            "rejected_queue_full": self._stats["rejected_queue_full"],
+            "rejected_timeout": self._stats["rejected_timeout"],
+            "avg_queue_wait_ms": round(self._stats["total_queue_wait_ms"] / admitted, 3) if admitted else 0.0,
+            "max_queue_wait_ms": round(self._stats["max_queue_wait_ms"], 3)
+        }
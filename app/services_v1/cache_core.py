@@ -0,0 +1,505 @@
+"""
+Caching helpers shared by the RAG and SQL agents
+"""
+
+import os
+import re
+import time
+import asyncio
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Set
+
+# --- Embedding Cache Settings ---
+EMBEDDING_CACHE_CONFIG = {
+    "max_size": int(os.getenv("EMBEDDING_CACHE_MAX_SIZE", "5000")),
+    "persistent": os.getenv("EMBEDDING_CACHE_PERSISTENT", "false").lower() == "true"
+}
+
+# --- Semantic Response Cache Settings ---
+RESPONSE_CACHE_CONFIG = {
+    "enabled": os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true",
+    "threshold": float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95")),
+    "ttl_seconds": float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600")),
+    "max_size": int(os.getenv("RESPONSE_CACHE_MAX_SIZE", "1000"))
+}
+
+# --- SQL Result Cache Settings ---
+RESULT_CACHE_CONFIG = {
+    "enabled": os.getenv("SQL_RESULT_CACHE_ENABLED", "true").lower() == "true",
+    "ttl_seconds": float(os.getenv("SQL_RESULT_CACHE_TTL_SECONDS", "300")),
+    "max_size": int(os.getenv("SQL_RESULT_CACHE_MAX_SIZE", "500")),
+    "max_rows": int(os.getenv("SQL_RESULT_CACHE_MAX_ROWS", "1000")),
+    # How long a read of the table version counters is trusted before checking again
+    "version_check_seconds": float(os.getenv("SQL_RESULT_CACHE_VERSION_CHECK_SECONDS", "1")),
+    "tables": ["forex_trades"]
+}
+
+_WHITESPACE = re.compile(r'\s+')
+_TRAILING_PUNCTUATION = re.compile(r'[\s?!.]+$')
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text for cache keys: lowercase, single spaces, no trailing punctuation."""
+    text = _WHITESPACE.sub(' ', text.strip().lower())
+    return _TRAILING_PUNCTUATION.sub('', text)
+
+
+def text_key(text: str) -> str:
+    """Stable hash of the normalized text."""
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+_SQL_QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+_SQL_KEYWORD_FROM = re.compile(r'\b(?:extract|substring|trim|overlay|position)\s*\([^()]*\)', re.IGNORECASE)
+_SQL_CTE_NAME = re.compile(r'\b(\w+)\s+as\s*\(', re.IGNORECASE)
+_SQL_TOKEN = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|\w+|[^\w\s]""")
+# Words ending a FROM list; anything else between two commas is a table reference and its alias
+_FROM_LIST_END = {
+    "where", "group", "order", "having", "limit", "offset", "fetch", "window", "union", "intersect",
+    "except", "for", "join", "inner", "left", "right", "full", "cross", "natural", "on", "using", "returning"
+}
+
+
+def canonical_sql(sql: str) -> str:
+    """SQL with whitespace collapsed, keywords lowercased and no trailing semicolon.
+    
+    Quoted literals and identifiers are kept verbatim.
+    """
+    parts = _SQL_QUOTED.split(sql.strip().rstrip(';').strip())
+    return ''.join(
+        part if i % 2 else _WHITESPACE.sub(' ', part.lower())
+        for i, part in enumerate(parts)
+    )
+
+
+def _identifier(token: str) -> str:
+    return token[1:-1].replace('""', '"') if token.startswith('"') else token.lower()
+
+
+def referenced_tables(sql: str) -> Set[str]:
+    """Lowercased names of the tables a SELECT reads, without schema or CTE names.
+
+    Follows FROM lists (FROM a, b), joins and subqueries. Returns an empty
+    set when a table source isn't a plain name (a function such as
+    generate_series, LATERAL, ROWS FROM), so callers treat the SQL as
+    uncacheable rather than miss a table.
+    """
+    tokens = _SQL_TOKEN.findall(_SQL_KEYWORD_FROM.sub(' ', canonical_sql(sql)))
+    ctes = {name.lower() for name in _SQL_CTE_NAME.findall(' '.join(tokens))}
+    tables = set()
+
+    def table_at(i: int) -> Optional[int]:
+        """Record the table reference starting at tokens[i]; the index after it, or None if unsure."""
+        if i < len(tokens) and tokens[i] == '(':
+            return i  # subquery: its own FROM is scanned in turn
+        if i < len(tokens) and tokens[i].lower() == 'only':
+            i += 1
+        if i >= len(tokens) or not (tokens[i][0] == '"' or tokens[i][0].isalpha() or tokens[i][0] == '_'):
+            return None
+        name, i = tokens[i], i + 1
+        while i + 1 < len(tokens) and tokens[i] == '.':
+            name, i = tokens[i + 1], i + 2
+        if name.lower() in ('lateral', 'rows') or (i < len(tokens) and tokens[i] == '('):
+            return None  # function or LATERAL source
+        tables.add(_identifier(name))
+        return i
+
+    for i, token in enumerate(tokens):
+        keyword = token.lower()
+        if keyword not in ('from', 'join'):
+            continue
+        position = table_at(i + 1)
+        if position is None:
+            return set()
+        if keyword == 'join':
+            continue
+
+        # The rest of the FROM list: "a x, b y, (subquery) z"
+        depth = 0
+        while position < len(tokens):
+            token = tokens[position]
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                if depth == 0:
+                    break
+                depth -= 1
+            elif depth == 0 and token.lower() in _FROM_LIST_END:
+                break
+            elif depth == 0 and token == ',':
+                position = table_at(position + 1)
+                if position is None:
+                    return set()
+                continue
+            position += 1
+
+    return tables - ctes
+
+
+class EmbeddingCache:
+    """In-process LRU of query embeddings, optionally backed by a Postgres table.
+
+    The Postgres table lets every gunicorn worker share embeddings computed by
+    any other worker. Entries are keyed on the embedding model and the
+    normalized query text.
+    """
+
+    def __init__(self, model: str, max_size: int = None, persistent: bool = None):
+        self.model = model
+        self.max_size = max_size if max_size is not None else EMBEDDING_CACHE_CONFIG["max_size"]
+        self.persistent = persistent if persistent is not None else EMBEDDING_CACHE_CONFIG["persistent"]
+        self.pool = None
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._stats = {"memory_hits": 0, "db_hits": 0, "misses": 0, "evictions": 0}
+
+    async def initialize(self, pool):
+        """Attach the connection pool and create the shared table if enabled."""
+        self.pool = pool
+        if not self.persistent:
+            return
+
+        async with pool.acquire() as conn:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS query_embedding_cache (
+                    model TEXT NOT NULL,
+                    text_key TEXT NOT NULL,
+                    embedding vector(768) NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (model, text_key)
+                )
+            """)
+
+    def _remember(self, key: str, embedding: List[float]):
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    async def get(self, text: str) -> Optional[List[float]]:
+        """Return the cached embedding for text, or None."""
+        key = text_key(text)
+
+        embedding = self._entries.get(key)
+        if embedding is not None:
+            self._entries.move_to_end(key)
+            self._stats["memory_hits"] += 1
+            return embedding
+
+        if self.persistent and self.pool is not None:
+            async with self.pool.acquire() as conn:
+                embedding = await conn.fetchval("""
+                    SELECT embedding FROM query_embedding_cache
+                    WHERE model = $1 AND text_key = $2
+                """, self.model, key)
+            if embedding is not None:
+                self._remember(key, embedding)
+                self._stats["db_hits"] += 1
+                return embedding
+
+        self._stats["misses"] += 1
+        return None
+
+    async def put(self, text: str, embedding: List[float]):
+        """Store an embedding in memory and, if enabled, in Postgres."""
+        key = text_key(text)
+        self._remember(key, embedding)
+
+        if self.persistent and self.pool is not None:
+            async with self.pool.acquire() as conn:
+                await conn.execute("""
+                    INSERT INTO query_embedding_cache (model, text_key, embedding)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (model, text_key) DO NOTHING
+                """, self.model, key, embedding)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size."""
+        hits = self._stats["memory_hits"] + self._stats["db_hits"]
+        lookups = hits + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "persistent": self.persistent
+        }
+
+
+class SemanticCache:
+    """Embedding-keyed cache that matches near-duplicate queries by cosine similarity.
+
+    Lookups compare the query embedding against every live entry in one
+    matrix-vector product; the best match above the threshold wins. Entries
+    expire after ttl_seconds and the least recently used entry is evicted
+    once max_size is reached.
+    """
+
+    def __init__(self, threshold: float = None, ttl_seconds: float = None, max_size: int = None):
+        self.threshold = threshold if threshold is not None else RESPONSE_CACHE_CONFIG["threshold"]
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else RESPONSE_CACHE_CONFIG["ttl_seconds"]
+        self.max_size = max_size if max_size is not None else RESPONSE_CACHE_CONFIG["max_size"]
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._matrix = None
+        self._keys: List[str] = []
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _invalidate_matrix(self):
+        self._matrix = None
+        self._keys = []
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items() if entry["expires_at"] <= now]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._stats["expired"] += len(expired)
+            self._invalidate_matrix()
+
+    def lookup(self, embedding) -> Optional[Dict[str, Any]]:
+        """Return the best cached entry above the similarity threshold, or None."""
+        self._purge_expired()
+        if not self._entries:
+            self._stats["misses"] += 1
+            return None
+
+        if self._matrix is None:
+            self._keys = list(self._entries.keys())
+            self._matrix = np.stack([self._entries[key]["embedding"] for key in self._keys])
+
+        similarities = self._matrix @ self._unit(embedding)
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+
+        if similarity < self.threshold:
+            self._stats["misses"] += 1
+            return None
+
+        key = self._keys[best]
+        self._entries.move_to_end(key)
+        self._stats["hits"] += 1
+        entry = self._entries[key]
+        return {"query": entry["query"], "value": entry["value"], "similarity": similarity}
+
+    def store(self, query: str, embedding, value: Any):
+        """Cache value for query under its embedding."""
+        key = text_key(query)
+        self._entries[key] = {
+            "query": query,
+            "embedding": self._unit(embedding),
+            "value": value,
+            "expires_at": time.monotonic() + self.ttl_seconds
+        }
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+        self._stats["stores"] += 1
+        self._invalidate_matrix()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size."""
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl_seconds
+        }
+
+
+class SingleFlight:
+    """Run one call per key at a time and hand its result to every concurrent caller.
+
+    The first caller for a key starts the call as a task; callers arriving
+    while it is in flight await the same task instead of repeating the work.
+    Every caller awaits it through asyncio.shield, so any one of them
+    disconnecting (the first included) leaves the call running for the
+    rest; it is only cancelled once no caller is left. Nothing is kept once
+    the call finishes, so this coalesces but never caches.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[asyncio.Future, int] = {}
+        self._stats = {"calls": 0, "coalesced": 0, "max_waiters": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Return fn()'s result, sharing it with concurrent callers using the same key."""
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(fn())
+            self._calls[key] = call
+            self._waiters[call] = 0
+            self._stats["calls"] += 1
+            call.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self._stats["coalesced"] += 1
+            self._stats["max_waiters"] = max(self._stats["max_waiters"], self._waiters[call])
+
+        self._waiters[call] += 1
+        try:
+            return await asyncio.shield(call)
+        except asyncio.CancelledError:
+            if not call.done() and self._waiters[call] == 1:
+                call.cancel()  # the last caller left; nobody wants the result
+            raise
+        finally:
+            self._waiters[call] -= 1
+            if not self._waiters[call]:
+                del self._waiters[call]
+
+    def _forget(self, key: str, call: asyncio.Future):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Calls run, callers coalesced onto them, and the most callers sharing one call."""
+        total = self._stats["calls"] + self._stats["coalesced"]
+        return {
+            **self._stats,
+            "coalesce_rate": round(self._stats["coalesced"] / total, 4) if total else 0.0,
+            "in_flight": len(self._calls)
+        }
+
+
+class QueryResultCache:
+    """TTL + LRU cache of SQL query results, invalidated by table change counters.
+    
+    Entries are keyed on the canonical SQL and its parameters. A trigger on
+    each tracked table bumps that table's row in table_versions on every
+    write, and an entry is only served while the versions of the tables it
+    read are unchanged (versions are re-read at most every
+    version_check_seconds). Queries reading an untracked table are never
+    cached.
+    """
+
+    def __init__(self, ttl_seconds: float = None, max_size: int = None, max_rows: int = None,
+                 version_check_seconds: float = None):
+        self.enabled = RESULT_CACHE_CONFIG["enabled"]
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else RESULT_CACHE_CONFIG["ttl_seconds"]
+        self.max_size = max_size if max_size is not None else RESULT_CACHE_CONFIG["max_size"]
+        self.max_rows = max_rows if max_rows is not None else RESULT_CACHE_CONFIG["max_rows"]
+        self.version_check_seconds = (
+            version_check_seconds if version_check_seconds is not None
+            else RESULT_CACHE_CONFIG["version_check_seconds"]
+        )
+        self.pool = None
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._checked_at = 0.0
+        self._stats = {
+            "hits": 0, "misses": 0, "stores": 0, "uncacheable": 0,
+            "invalidated": 0, "expired": 0, "evictions": 0
+        }
+
+    async def initialize(self, pool, tables: List[str] = None):
+        """Install the version counter table and the change triggers on each tracked table."""
+        self.pool = pool
+        if not self.enabled:
+            return
+
+        async with pool.acquire() as conn:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS table_versions (
+                    table_name TEXT PRIMARY KEY,
+                    version BIGINT NOT NULL DEFAULT 0
+                );
+                CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+                BEGIN
+                    INSERT INTO table_versions (table_name, version) VALUES (TG_TABLE_NAME, 1)
+                    ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+            """)
+            for table in tables or RESULT_CACHE_CONFIG["tables"]:
+                await conn.execute(f"""
+                    INSERT INTO table_versions (table_name) VALUES ('{table}') ON CONFLICT DO NOTHING;
+                    DO $$
+                    BEGIN
+                        IF NOT EXISTS (
+                            SELECT 1 FROM pg_trigger
+                            WHERE tgname = '{table}_version_bump' AND tgrelid = '{table}'::regclass
+                        ) THEN
+                            CREATE TRIGGER {table}_version_bump
+                            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+                            FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+                        END IF;
+                    END $$;
+                """)
+
+    async def _current_versions(self) -> Dict[str, int]:
+        if time.monotonic() - self._checked_at >= self.version_check_seconds:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch("SELECT table_name, version FROM table_versions")
+            self._versions = {row["table_name"]: row["version"] for row in rows}
+            self._checked_at = time.monotonic()
+        return self._versions
+
+    def _evict(self, key: str, reason: str):
+        del self._entries[key]
+        self._stats[reason] += 1
+
+    async def fetch(self, sql: str, args: tuple, run: Callable[[], Awaitable[List]]) -> List:
+        """Return run()'s rows for this SQL and args, from the cache while the tables are unchanged."""
+        if not self.enabled or self.pool is None:
+            return await run()
+
+        tables = referenced_tables(sql)
+        versions = await self._current_versions()
+        if not tables or any(table not in versions for table in tables):
+            self._stats["uncacheable"] += 1
+            return await run()
+
+        key = hashlib.sha256(f"{canonical_sql(sql)}\x00{args!r}".encode('utf-8')).hexdigest()
+        snapshot = {table: versions[table] for table in tables}
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry["versions"] != snapshot:
+                self._evict(key, "invalidated")
+            elif entry["expires_at"] <= time.monotonic():
+                self._evict(key, "expired")
+            else:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry["rows"]
+
+        # The snapshot was read before running, so a write during the query leaves it stale, never the rows
+        self._stats["misses"] += 1
+        rows = await run()
+        if len(rows) <= self.max_rows:
+            self._entries[key] = {
+                "rows": rows,
+                "versions": snapshot,
+                "expires_at": time.monotonic() + self.ttl_seconds
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+            self._stats["stores"] += 1
+        return rows
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters, invalidations and current size."""
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "table_versions": dict(self._versions)
+        }
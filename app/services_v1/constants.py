@@ -78,3 +78,49 @@ IMPORTANT FOR RAG QUERIES:
 
 Remember: You coordinate experts. Plan, delegate, synthesize.
 """
+
+# Keywords the orchestrator routes to the SQL Agent (see ROUTING RULES above)
+SQL_ROUTING_KEYWORDS = ["profit", "loss", "trades", "calculate", "show", "total", "win rate"]
+
+# Plural forms the router also matches (keywords are matched as whole words, so "shows" is not "show")
+SQL_ROUTING_PLURALS = ["profits", "losses", "totals", "win rates"]
+
+# First-person words that mark a question as being about the user's own account
+PERSONAL_PRONOUNS = ["my", "me", "mine", "i", "i've", "i'm"]
+
+# Keywords the orchestrator routes to the RAG Agent (see ROUTING RULES above)
+RAG_ROUTING_KEYWORDS = ["what is", "what are", "how to", "how do", "how can", "explain", "procedure", "definition"]
+
+# Further signs of a question for the knowledge base rather than the user's trading data
+KNOWLEDGE_QUESTION_KEYWORDS = [
+    "how does", "who", "where", "can i", "do i need", "should i", "is it possible", "contact", "email"
+]
+
+# Words asking for an explanation on top of data; with a trading-data question they need both agents
+EXPLANATION_KEYWORDS = ["explain", "why", "mean", "means", "tell me", "affect", "affects", "is it good", "is that good"]
+
+# Words referring back to earlier turns; in a session with history such messages need that history
+FOLLOW_UP_KEYWORDS = [
+    "it", "its", "that", "those", "these", "them", "they", "what about", "how about",
+    "same", "instead", "previous", "above", "earlier", "again"
+]
+
+# Messages answered directly, without calling any agent
+GREETINGS = ["hi", "hello", "hey", "good morning", "good afternoon", "good evening", "greetings", "hi there", "hello there"]
+
+GREETING_RESPONSE = (
+    "Hello! I'm the HFM Digital Assistant. I can answer questions about HFM, trading and our platforms, "
+    "and analyse your own trading data - profits, losses, trades and win rate. How can I help?"
+)
+
+# Example SQL Agent questions, used to build the router's embedding centroid for trading-data queries
+SQL_ROUTING_EXAMPLES = [
+    "What's my profit?",
+    "What's my total loss this month?",
+    "Show me my trades",
+    "Calculate my win rate",
+    "How much did I make?",
+    "What was my best trade last week?",
+    "How many trades did I close on EURUSD?",
+    "What is my average profit per trade?"
+]
@@ -0,0 +1,135 @@
+"""
+Token-budgeted context building for knowledge-base search results
+"""
+
+import os
+import re
+import math
+from typing import List, Dict, Any, Tuple
+
+# --- Search Context Settings ---
+SEARCH_CONTEXT_CONFIG = {
+    "max_tokens": int(os.getenv("SEARCH_CONTEXT_MAX_TOKENS", "800")),
+    "max_answer_tokens": int(os.getenv("SEARCH_CONTEXT_MAX_ANSWER_TOKENS", "250")),
+    "min_similarity": float(os.getenv("SEARCH_CONTEXT_MIN_SIMILARITY", "0.5")),
+    "chars_per_token": float(os.getenv("SEARCH_CONTEXT_CHARS_PER_TOKEN", "4"))
+}
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+|\n+')
+_WORD = re.compile(r'\w+')
+
+# Words too common to say anything about which sentence is relevant
+_STOPWORDS = {
+    "a", "an", "and", "are", "can", "do", "does", "for", "how", "i", "in", "is", "it", "my",
+    "of", "on", "or", "the", "to", "what", "when", "where", "which", "who", "why", "with", "you"
+}
+
+HEADER = "Search Results:\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate LLM token count of text (characters / chars_per_token)."""
+    return math.ceil(len(text) / SEARCH_CONTEXT_CONFIG["chars_per_token"])
+
+
+def _terms(text: str) -> set:
+    return {word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS}
+
+
+class ContextBuilder:
+    """Render search results into a block that fits a token budget.
+
+    Results below min_similarity are dropped (the top result is always
+    kept), long answers are cut down to the sentences that share the most
+    terms with the query, and results are added best first until the
+    budget is spent.
+    """
+
+    def __init__(self, max_tokens: int = None, max_answer_tokens: int = None, min_similarity: float = None):
+        self.max_tokens = max_tokens or SEARCH_CONTEXT_CONFIG["max_tokens"]
+        self.max_answer_tokens = max_answer_tokens or SEARCH_CONTEXT_CONFIG["max_answer_tokens"]
+        self.min_similarity = min_similarity if min_similarity is not None else SEARCH_CONTEXT_CONFIG["min_similarity"]
+        self._stats = {
+            "builds": 0, "results_in": 0, "results_kept": 0,
+            "answers_truncated": 0, "tokens": 0, "max_tokens_built": 0
+        }
+
+    def truncate_answer(self, query: str, answer: str, max_tokens: int) -> str:
+        """Keep the answer sentences most relevant to the query, in their original order."""
+        if estimate_tokens(answer) <= max_tokens:
+            return answer
+
+        sentences = [sentence.strip() for sentence in _SENTENCE_END.split(answer) if sentence.strip()]
+        query_terms = _terms(query)
+        # Most query terms first; earlier sentences win ties since answers usually lead with the point
+        ranked = sorted(
+            range(len(sentences)),
+            key=lambda i: (-len(query_terms & _terms(sentences[i])), i)
+        )
+
+        chosen, used = [], 0
+        for i in ranked:
+            cost = estimate_tokens(sentences[i]) + 1
+            if used + cost > max_tokens:
+                continue
+            chosen.append(i)
+            used += cost
+
+        if not chosen:
+            # A single sentence longer than the budget: hard cut on characters
+            limit = int(max_tokens * SEARCH_CONTEXT_CONFIG["chars_per_token"])
+            return sentences[ranked[0]][:limit].rstrip() + " …"
+
+        parts, previous = [], -1
+        for i in sorted(chosen):
+            if i != previous + 1:
+                parts.append("…")
+            parts.append(sentences[i])
+            previous = i
+        if previous < len(sentences) - 1:
+            parts.append("…")
+        return " ".join(parts)
+
+    def build(self, query: str, results: List[Dict[str, Any]]) -> Tuple[str, int]:
+        """Return (context text, estimated tokens) for results, which arrive best first."""
+        # Lexical-only hits carry a text-rank score, not a cosine similarity, so the cutoff skips them
+        relevant = [
+            result for i, result in enumerate(results)
+            if i == 0 or result.get("match_type") == "lexical" or result.get("similarity", 0.0) >= self.min_similarity
+        ]
+
+        blocks = []
+        tokens = estimate_tokens(HEADER)
+        truncated = 0
+        for result in relevant:
+            answer = self.truncate_answer(query, result["answer"], self.max_answer_tokens)
+            block = f"""[Result {len(blocks) + 1}]
+Question: {result['question']}
+Answer: {answer}
+"""
+            cost = estimate_tokens(block)
+            if blocks and tokens + cost > self.max_tokens:
+                break
+            truncated += answer != result["answer"]
+            blocks.append(block)
+            tokens += cost
+
+        self._stats["builds"] += 1
+        self._stats["results_in"] += len(results)
+        self._stats["results_kept"] += len(blocks)
+        self._stats["answers_truncated"] += truncated
+        self._stats["tokens"] += tokens
+        self._stats["max_tokens_built"] = max(self._stats["max_tokens_built"], tokens)
+
+        return "\n".join([HEADER] + blocks), tokens
+
+    def stats(self) -> Dict[str, Any]:
+        """Result and token counters for the contexts built so far."""
+        builds = self._stats["builds"]
+        return {
+            **self._stats,
+            "avg_tokens": round(self._stats["tokens"] / builds, 1) if builds else 0.0,
+            "max_tokens": self.max_tokens,
+            "max_answer_tokens": self.max_answer_tokens,
+            "min_similarity": self.min_similarity
+        }
@@ -0,0 +1,125 @@
+"""
+Batched, concurrent, rate-limited embedding pipeline for knowledge-base loads
+"""
+
+import os
+import time
+import asyncio
+from typing import List, Dict, Any, Callable, Awaitable
+from tenacity import AsyncRetrying, stop_after_attempt, wait_exponential_jitter
+
+from app.services_v1.rate_limit import get_rate_limiter
+
+# --- Pipeline Settings ---
+EMBEDDING_PIPELINE_CONFIG = {
+    "batch_size": int(os.getenv("EMBEDDING_BATCH_SIZE", "100")),
+    "max_concurrency": int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4")),
+    "requests_per_second": float(os.getenv("EMBEDDING_REQUESTS_PER_SECOND", "5")),
+    "burst": int(os.getenv("EMBEDDING_BURST", "4")),
+    "max_attempts": int(os.getenv("EMBEDDING_MAX_ATTEMPTS", "5"))
+}
+
+BatchSink = Callable[[List[Dict], List[List[float]], List[List[float]]], Awaitable[None]]
+
+
+class EmbeddingPipeline:
+    """Embed Q&A pairs in provider-sized batches and hand each finished batch to a sink.
+
+    At most max_concurrency embedding requests are in flight, every request
+    takes a token from the model's shared token bucket, and failed requests
+    are retried with exponential backoff. Batches are delivered to the sink
+    as soon as they complete, so writes overlap with later embedding calls.
+    Each distinct answer text is embedded once per run; answers whose
+    embedding is already known are not sent to the provider at all.
+    """
+    
+    def __init__(self, embeddings, model: str, batch_size: int = None, max_concurrency: int = None):
+        self.embeddings = embeddings
+        self.batch_size = batch_size or EMBEDDING_PIPELINE_CONFIG["batch_size"]
+        self.semaphore = asyncio.Semaphore(max_concurrency or EMBEDDING_PIPELINE_CONFIG["max_concurrency"])
+        self.rate_limiter = get_rate_limiter(
+            f"embeddings:{model}",
+            EMBEDDING_PIPELINE_CONFIG["requests_per_second"],
+            EMBEDDING_PIPELINE_CONFIG["burst"]
+        )
+        self.requests = 0
+        self.retries = 0
+        self.answers_reused = 0
+        self._pending_answers: Dict[str, asyncio.Future] = {}
+    
+    async def _embed(self, texts: List[str]) -> List[List[float]]:
+        """One rate-limited, retried embedding request."""
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(EMBEDDING_PIPELINE_CONFIG["max_attempts"]),
+            wait=wait_exponential_jitter(initial=1, max=30),
+            reraise=True
+        ):
+            with attempt:
+                if attempt.retry_state.attempt_number > 1:
+                    self.retries += 1
+                async with self.semaphore:
+                    await self.rate_limiter.aacquire()
+                    self.requests += 1
+                    return await self.embeddings.aembed_documents(texts)
+    
+    async def _embed_answers(self, answers: List[str], known_answers: Dict[str, List[float]]):
+        # Answers another batch is already embedding are awaited rather than re-sent
+        new_answers = [
+            answer for answer in dict.fromkeys(answers)
+            if answer not in known_answers and answer not in self._pending_answers
+        ]
+        if new_answers:
+            pending = asyncio.get_running_loop().create_future()
+            for answer in new_answers:
+                self._pending_answers[answer] = pending
+            try:
+                known_answers.update(zip(new_answers, await self._embed(new_answers)))
+                pending.set_result(None)
+            finally:
+                pending.cancel()  # no-op once resolved; wakes waiters if embedding failed
+                for answer in new_answers:
+                    del self._pending_answers[answer]
+        
+        waiting = {self._pending_answers[answer] for answer in answers if answer in self._pending_answers}
+        if waiting:
+            await asyncio.gather(*waiting)
+        
+        self.answers_reused += len(answers) - len(new_answers)
+        return [known_answers[answer] for answer in answers]
+    
+    async def _embed_batch(self, batch: List[Dict], known_answers: Dict[str, List[float]]):
+        question_embeddings, answer_embeddings = await asyncio.gather(
+            self._embed([qa["question"] for qa in batch]),
+            self._embed_answers([qa["answer"] for qa in batch], known_answers)
+        )
+        return batch, question_embeddings, answer_embeddings
+    
+    async def run(self, qa_pairs: List[Dict], sink: BatchSink,
+                  known_answers: Dict[str, List[float]] = None) -> Dict[str, Any]:
+        """Embed every pair and stream completed batches into sink.
+        
+        known_answers maps answer text to an existing embedding and is
+        extended with every answer embedded during the run.
+        """
+        start = time.perf_counter()
+        known_answers = known_answers if known_answers is not None else {}
+        batches = [qa_pairs[i:i + self.batch_size] for i in range(0, len(qa_pairs), self.batch_size)]
+        tasks = [asyncio.create_task(self._embed_batch(batch, known_answers)) for batch in batches]
+        
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                batch, question_embeddings, answer_embeddings = await next_done
+                await sink(batch, question_embeddings, answer_embeddings)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        
+        return {
+            "batches": len(batches),
+            "requests": self.requests,
+            "retries": self.retries,
+            "answers_reused": self.answers_reused,
+            "embed_seconds": round(time.perf_counter() - start, 3)
+        }
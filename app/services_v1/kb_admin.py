@@ -0,0 +1,108 @@
+"""
+Knowledge-base maintenance commands
+
+    python -m app.services_v1.kb_admin build-snapshot
+    python -m app.services_v1.kb_admin rebuild-index [--type hnsw|ivfflat|none]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import pandas as pd
+from typing import List, Dict, Any
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Add project root to path for imports
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from app.services_v1.rag_agent_core import (
+    KB_CSV_FILES,
+    EMBEDDING_MODEL,
+    VECTOR_INDEX_CONFIG,
+    PGVectorStore,
+    build_qa_frame
+)
+from app.services_v1.embedding_pipeline import EmbeddingPipeline
+from app.services_v1.kb_snapshot import write_snapshot
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+
+async def build_snapshot(model: str, csv_files: List[str], base_dir: str = None) -> str:
+    """Embed the CSV files once and write them as a snapshot."""
+    start = time.perf_counter()
+    embeddings = GoogleGenerativeAIEmbeddings(model=model, google_api_key=os.getenv("GOOGLE_API_KEY"))
+    
+    records: List[Dict] = []
+    for csv_file in csv_files:
+        csv_path = os.path.join(project_root, csv_file)
+        if not os.path.exists(csv_path):
+            print(f"⚠️ Skipping missing file: {csv_file}")
+            continue
+        # Sources are stored as file names so the snapshot is portable between machines
+        records.extend(build_qa_frame(pd.read_csv(csv_path), csv_file).to_dict("records"))
+    
+    # Batches may finish out of order, so write each one back into its row slots
+    positions = {id(qa): i for i, qa in enumerate(records)}
+    question_embeddings: List[Any] = [None] * len(records)
+    answer_embeddings: List[Any] = [None] * len(records)
+    
+    async def collect(batch, batch_questions, batch_answers):
+        for qa, q_emb, a_emb in zip(batch, batch_questions, batch_answers):
+            question_embeddings[positions[id(qa)]] = q_emb
+            answer_embeddings[positions[id(qa)]] = a_emb
+    
+    await EmbeddingPipeline(embeddings, model).run(records, collect)
+    
+    path = write_snapshot(model, records, question_embeddings, answer_embeddings, base_dir)
+    print(f"✅ Wrote snapshot of {len(records)} Q&A pairs to {path} in {time.perf_counter() - start:.1f}s")
+    return path
+
+
+async def rebuild_index(index_type: str = None):
+    """Rebuild the qa_pairs ANN indexes with the configured (or given) strategy."""
+    connection_string = os.getenv("PGVECTOR_CONNECTION")
+    if not connection_string:
+        raise RuntimeError("PGVECTOR_CONNECTION not set")
+    if index_type:
+        VECTOR_INDEX_CONFIG["type"] = index_type
+    
+    store = PGVectorStore(connection_string, EMBEDDING_MODEL)
+    try:
+        start = time.perf_counter()
+        actions = await store.rebuild_vector_indexes()
+        print(f"✅ {actions} in {time.perf_counter() - start:.1f}s")
+    finally:
+        await store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HFM knowledge-base maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    snapshot_cmd = commands.add_parser("build-snapshot", help="Embed the CSV files into an offline snapshot")
+    snapshot_cmd.add_argument("--model", default=EMBEDDING_MODEL)
+    snapshot_cmd.add_argument("--output-dir", default=None, help="Defaults to KB_SNAPSHOT_DIR")
+    snapshot_cmd.add_argument("csv_files", nargs="*", default=KB_CSV_FILES)
+    
+    index_cmd = commands.add_parser("rebuild-index", help="Rebuild the qa_pairs ANN indexes")
+    index_cmd.add_argument("--type", choices=["hnsw", "ivfflat", "none"], default=None,
+                           help="Defaults to QA_VECTOR_INDEX")
+    
+    args = parser.parse_args()
+    
+    if args.command == "build-snapshot":
+        if not os.getenv("GOOGLE_API_KEY"):
+            raise RuntimeError("GOOGLE_API_KEY not set")
+        asyncio.run(build_snapshot(args.model, args.csv_files, args.output_dir))
+    elif args.command == "rebuild-index":
+        asyncio.run(rebuild_index(args.type))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Pre-computed knowledge-base embedding snapshots
+
+A snapshot holds the embedded CSV rows for one embedding model:
+
+    <KB_SNAPSHOT_DIR>/<model slug>/
+        question_embeddings.npy   float32 matrix, one row per Q&A pair
+        answer_embeddings.npy     float32 matrix, same row order
+        metadata.json             model, dimension and per-row qa_id/question/answer/source/content_hash
+
+The matrices are plain .npy files so they can be memory-mapped.
+"""
+
+import os
+import re
+import json
+import numpy as np
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+KB_SNAPSHOT_DIR = os.getenv("KB_SNAPSHOT_DIR", os.path.join(project_root, "snapshots"))
+
+QUESTION_FILE = "question_embeddings.npy"
+ANSWER_FILE = "answer_embeddings.npy"
+METADATA_FILE = "metadata.json"
+
+
+def snapshot_path(model: str, base_dir: str = None) -> str:
+    """Directory holding the snapshot for an embedding model."""
+    slug = re.sub(r'[^A-Za-z0-9._-]+', '_', model).strip('_')
+    return os.path.join(base_dir or KB_SNAPSHOT_DIR, slug)
+
+
+def snapshot_exists(model: str, base_dir: str = None) -> bool:
+    path = snapshot_path(model, base_dir)
+    return all(os.path.exists(os.path.join(path, name)) for name in (QUESTION_FILE, ANSWER_FILE, METADATA_FILE))
+
+
+def write_snapshot(model: str, records: List[Dict], question_embeddings, answer_embeddings,
+                   base_dir: str = None) -> str:
+    """Write a snapshot for model and return its directory.
+
+    records carry qa_id, question, answer, source (the CSV file name) and
+    content_hash, in the same order as the embedding rows.
+    """
+    path = snapshot_path(model, base_dir)
+    os.makedirs(path, exist_ok=True)
+
+    questions = np.asarray(question_embeddings, dtype=np.float32)
+    answers = np.asarray(answer_embeddings, dtype=np.float32)
+    if questions.shape != answers.shape or questions.shape[0] != len(records):
+        raise ValueError("Snapshot matrices and records must have the same number of rows")
+
+    np.save(os.path.join(path, QUESTION_FILE), questions)
+    np.save(os.path.join(path, ANSWER_FILE), answers)
+    with open(os.path.join(path, METADATA_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "model": model,
+            "dim": int(questions.shape[1]) if questions.ndim == 2 else 0,
+            "rows": len(records),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "records": records
+        }, f, ensure_ascii=False)
+
+    return path
+
+
+def read_snapshot(model: str, base_dir: str = None) -> Optional[Dict[str, Any]]:
+    """Open the snapshot for model with memory-mapped matrices, or None if absent."""
+    if not snapshot_exists(model, base_dir):
+        return None
+
+    path = snapshot_path(model, base_dir)
+    with open(os.path.join(path, METADATA_FILE), encoding="utf-8") as f:
+        metadata = json.load(f)
+
+    if metadata["model"] != model:
+        raise ValueError(f"Snapshot at {path} was built for {metadata['model']}, not {model}")
+
+    return {
+        **metadata,
+        "question_embeddings": np.load(os.path.join(path, QUESTION_FILE), mmap_mode="r"),
+        "answer_embeddings": np.load(os.path.join(path, ANSWER_FILE), mmap_mode="r")
+    }
+
@@ -5,7 +5,12 @@ Fixed Deep Agents RAG System - Properly Working Search
 import os
 import sys
 import asyncio
+import time
+import re
+import struct
+import hashlib
 import pandas as pd
+import numpy as np
 import json
 from typing import List, Dict, Any
 from dotenv import load_dotenv
@@ -23,237 +28,1231 @@ if project_root not in sys.path:
 
 from app.services_v1.constants import DEEP_AGENT_PROMPT
 from app.services_v1.sql_agent_core import sql_agent
+from app.services_v1.cache_core import EmbeddingCache
+from app.services_v1.embedding_pipeline import EmbeddingPipeline
+from app.services_v1.rate_limit import get_llm_rate_limiter
+from app.services_v1.context_builder import ContextBuilder
+from app.services_v1.kb_snapshot import read_snapshot
 
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import asyncpg
+from contextlib import asynccontextmanager
 from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
 from langchain_core.tools import BaseTool
 from deepagents import create_deep_agent
 from langchain.agents import create_agent
 from deepagents import CompiledSubAgent
+
+# --- Vector Store Pool Settings ---
+PGVECTOR_POOL_CONFIG = {
+    "min_size": int(os.getenv("PGVECTOR_POOL_MIN_SIZE", "2")),
+    "max_size": int(os.getenv("PGVECTOR_POOL_MAX_SIZE", "10")),
+    "statement_cache_size": int(os.getenv("PGVECTOR_STATEMENT_CACHE_SIZE", "100")),
+    "command_timeout": float(os.getenv("PGVECTOR_COMMAND_TIMEOUT", "10")),
+    "max_inactive_connection_lifetime": 300
+}
+
+# --- ANN Index Settings ---
+VECTOR_INDEX_CONFIG = {
+    "type": os.getenv("QA_VECTOR_INDEX", "hnsw"),  # hnsw | ivfflat | none
+    "hnsw_m": int(os.getenv("HNSW_M", "16")),
+    "hnsw_ef_construction": int(os.getenv("HNSW_EF_CONSTRUCTION", "64")),
+    "hnsw_ef_search": int(os.getenv("HNSW_EF_SEARCH", "40")),
+    "ivfflat_probes": int(os.getenv("IVFFLAT_PROBES", "10")),
+    # Per-statement limit for index builds, in place of the pool's PGVECTOR_COMMAND_TIMEOUT
+    "build_timeout_seconds": float(os.getenv("VECTOR_INDEX_BUILD_TIMEOUT_SECONDS", "3600"))
+}
+
+# (index name, embedding column, partial-index predicate) for every ANN index on qa_pairs.
+# Only one row per answer group carries the answer into the answer index.
+VECTOR_INDEXES = [
+    ("qa_question_embedding_idx", "question_embedding", None),
+    ("qa_answer_canonical_embedding_idx", "answer_embedding", "answer_is_canonical"),
+]
+
+# ANN indexes from earlier layouts, dropped when the indexes are reconciled
+RETIRED_VECTOR_INDEXES = ["qa_answer_embedding_idx"]
+
+
+def ivfflat_lists(row_count: int) -> int:
+    """pgvector's recommended list count: rows / 1000 up to 1M rows, sqrt(rows) beyond."""
+    if row_count <= 1_000_000:
+        return max(1, row_count // 1000)
+    return int(row_count ** 0.5)
+
+
+# Columns written by the bulk COPY path
+QA_COPY_COLUMNS = [
+    "qa_id", "question", "answer", "question_embedding", "answer_embedding", "source", "content_hash",
+    "question_key", "answer_group"
+]
+
+# --- Answer Collapsing Settings ---
+ANSWER_GROUP_CONFIG = {
+    # Answers whose embeddings are at least this similar share a group (> 1 disables clustering)
+    "similarity_threshold": float(os.getenv("ANSWER_GROUP_THRESHOLD", "0.97")),
+    # Question candidates fetched per requested result, before collapsing to distinct answers
+    "question_candidate_factor": int(os.getenv("ANSWER_GROUP_CANDIDATE_FACTOR", "4"))
+}
+
+# Similarity matrix cells computed per block while clustering answer groups (~16 MB of booleans)
+_ANSWER_GROUP_BLOCK_CELLS = 1 << 24
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "models/text-embedding-004")
+
+# Knowledge-base CSV files, relative to the project root
+KB_CSV_FILES = [
+    "qa_pairs.csv",
+    "qa_pairs_variations.csv",
+    "web_questions.csv",
+]
+
+# Similarity search backend: "pgvector" queries Postgres, "numpy" searches in-process matrices
+RAG_VECTOR_BACKEND = os.getenv("RAG_VECTOR_BACKEND", "pgvector")
+
+# How often in-memory indexes (numpy vectors, exact-question map) check Postgres for changes
+KB_MEMORY_REFRESH_SECONDS = float(os.getenv("KB_MEMORY_REFRESH_SECONDS", "30"))
+
+# Retrieval mode: "vector" (dual-ranked embeddings) or "hybrid" (full-text + vector with RRF)
+RAG_RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "vector")
+
+# Curated answers returned verbatim, skipping LLM synthesis, when the top match is this strong
+RAG_DIRECT_ANSWER_CONFIG = {
+    "enabled": os.getenv("RAG_DIRECT_ANSWER_ENABLED", "true").lower() == "true",
+    "min_score": float(os.getenv("RAG_DIRECT_ANSWER_MIN_SCORE", "0.85")),  # final_score, with match_type 'both'
+    "min_margin": float(os.getenv("RAG_DIRECT_ANSWER_MIN_MARGIN", "0.03"))  # lead over the next distinct answer
+}
+
+HYBRID_SEARCH_CONFIG = {
+    "candidates": int(os.getenv("HYBRID_CANDIDATES", "20")),  # per ranking, before fusion
+    "rrf_k": int(os.getenv("HYBRID_RRF_K", "60")),
+    "fast_path_max_terms": int(os.getenv("LEXICAL_FAST_PATH_MAX_TERMS", "4")),
+    "fast_path_margin": float(os.getenv("LEXICAL_FAST_PATH_MARGIN", "1.5"))
+}
+
+# "incremental" syncs each CSV against the table; "once" loads only into an empty table
+KB_LOAD_MODE = os.getenv("KB_LOAD_MODE", "incremental")
+
+# How long a worker waits for another worker's knowledge-base sync or snapshot load to finish
+KB_SYNC_LOCK_TIMEOUT_SECONDS = float(os.getenv("KB_SYNC_LOCK_TIMEOUT_SECONDS", "600"))
+
+# Separator between question and answer when hashing a row (matches chr(31) in SQL)
+_HASH_SEPARATOR = "\x1f"
+
+
+def _encode_vector(values) -> bytes:
+    """Encode a sequence as pgvector's binary format (dim, unused, big-endian float4s)."""
+    vector = np.asarray(values, dtype='>f4')
+    return struct.pack('>HH', vector.shape[0], 0) + vector.tobytes()
+
+
+def _decode_vector(data: bytes) -> List[float]:
+    """Decode pgvector's binary format into a list of floats."""
+    dim = struct.unpack_from('>H', data)[0]
+    return np.frombuffer(data, dtype='>f4', count=dim, offset=4).tolist()
+
+
+def content_hash(question: str, answer: str) -> str:
+    """SHA-256 of a (question, answer) row; identical in Python and SQL."""
+    return hashlib.sha256(f"{question}{_HASH_SEPARATOR}{answer}".encode("utf-8")).hexdigest()
+
+
+_NON_WORD = re.compile(r'[^\w]+')
+
+
+def _normalized_hash(text: str) -> str:
+    normalized = _NON_WORD.sub(' ', text.lower()).strip()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def question_key(question: str) -> str:
+    """Hash of a question with case, punctuation and spacing removed, for exact-match lookups."""
+    return _normalized_hash(question)
+
+
+def answer_key(answer: str) -> str:
+    """Initial answer group of a row: its answer with case, punctuation and spacing removed."""
+    return _normalized_hash(answer)
+
+
+def build_qa_frame(df: pd.DataFrame, source: str) -> pd.DataFrame:
+    """Turn a raw Q&A CSV frame into (qa_id, question, answer, source, content_hash) rows.
+    
+    Rows with an empty question or answer are dropped; qa_id falls back to
+    a generated Qa_NNN id when the CSV has none.
+    """
+    questions = df['user'].astype(str).str.strip()
+    answers = df['standard_answer'].astype(str).str.strip()
+    
+    qa_ids = "Qa_" + (df.index.to_series() + 1).astype(str).str.zfill(3)
+    if 'qa_id' in df.columns:
+        qa_ids = df['qa_id'].where(df['qa_id'].notna(), qa_ids).astype(str).str.strip()
+    
+    valid = (questions != '') & (answers != '') & (questions != 'nan') & (answers != 'nan')
+    
+    frame = pd.DataFrame({
+        "qa_id": qa_ids[valid],
+        "question": questions[valid],
+        "answer": answers[valid],
+        "source": source
+    })
+    frame["content_hash"] = [content_hash(q, a) for q, a in zip(frame["question"], frame["answer"])]
+    return frame
+
+
 class PGVectorStore:
-    """pgvector implementation with working search"""
+    """pgvector implementation backed by a shared asyncpg pool"""
+    
+    # Dual search weights - questions weighted higher than answers
+    QUESTION_WEIGHT = 0.7
+    ANSWER_WEIGHT = 0.3
     
     def __init__(self, connection_string: str, embedding_model: str):
         self.connection_string = connection_string
+        self.embedding_model = embedding_model
         self.embeddings = GoogleGenerativeAIEmbeddings(
             model=embedding_model,
             google_api_key=os.getenv("GOOGLE_API_KEY")
         )
+        self.embedding_cache = EmbeddingCache(embedding_model)
+        self._exact_index: Dict[str, Dict[str, Any]] = None
+        self._exact_version = None
+        self._exact_checked_at = 0.0
+        self.pool = None
+        self._pool_lock = asyncio.Lock()
+        self._pool_metrics = {
+            "acquisitions": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0
+        }
+    
+    @staticmethod
+    async def _init_connection(conn):
+        """Register the pgvector codec and default ANN search settings on every new pool connection."""
+        await conn.set_type_codec(
+            "vector",
+            encoder=_encode_vector,
+            decoder=_decode_vector,
+            schema="public",
+            format="binary"
+        )
+        await conn.execute(f"""
+            SET hnsw.ef_search = {int(VECTOR_INDEX_CONFIG["hnsw_ef_search"])};
+            SET ivfflat.probes = {int(VECTOR_INDEX_CONFIG["ivfflat_probes"])};
+        """)
+    
+    async def _get_pool(self):
+        """Create the connection pool on first use."""
+        if self.pool is None:
+            async with self._pool_lock:
+                if self.pool is None:
+                    self.pool = await asyncpg.create_pool(
+                        dsn=self.connection_string,
+                        init=self._init_connection,
+                        **PGVECTOR_POOL_CONFIG
+                    )
+        return self.pool
+    
+    @asynccontextmanager
+    async def _acquire(self):
+        """Acquire a pooled connection and record how long we waited for it."""
+        pool = await self._get_pool()
+        start = time.perf_counter()
+        async with pool.acquire() as conn:
+            wait_ms = (time.perf_counter() - start) * 1000
+            self._pool_metrics["acquisitions"] += 1
+            self._pool_metrics["total_wait_ms"] += wait_ms
+            self._pool_metrics["max_wait_ms"] = max(self._pool_metrics["max_wait_ms"], wait_ms)
+            yield conn
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """Pool sizing and acquisition metrics."""
+        acquisitions = self._pool_metrics["acquisitions"]
+        stats = {
+            "min_size": PGVECTOR_POOL_CONFIG["min_size"],
+            "max_size": PGVECTOR_POOL_CONFIG["max_size"],
+            "statement_cache_size": PGVECTOR_POOL_CONFIG["statement_cache_size"],
+            "size": 0,
+            "idle": 0,
+            "in_use": 0,
+            "acquisitions": acquisitions,
+            "avg_wait_ms": round(self._pool_metrics["total_wait_ms"] / acquisitions, 3) if acquisitions else 0.0,
+            "max_wait_ms": round(self._pool_metrics["max_wait_ms"], 3)
+        }
+        if self.pool is not None:
+            stats["size"] = self.pool.get_size()
+            stats["idle"] = self.pool.get_idle_size()
+            stats["in_use"] = stats["size"] - stats["idle"]
+        return stats
+    
+    async def close(self):
+        """Close the connection pool."""
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
         
     async def initialize(self):
         """Initialize database tables"""
-        conn = psycopg2.connect(self.connection_string)
-        cur = conn.cursor()
-        
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS qa_pairs (
-                id SERIAL PRIMARY KEY,
-                qa_id TEXT,
-                question TEXT NOT NULL,
-                answer TEXT NOT NULL,
-                question_embedding vector(768),
-                answer_embedding vector(768),
-                source TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        await self.embedding_cache.initialize(await self._get_pool())
+        
+        async with self._acquire() as conn:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS qa_pairs (
+                    id SERIAL PRIMARY KEY,
+                    qa_id TEXT,
+                    question TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    question_embedding vector(768),
+                    answer_embedding vector(768),
+                    source TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS qa_qa_id_idx 
+                ON qa_pairs (qa_id)
+            """)
+            
+            # Content hashes drive incremental sync; backfill rows loaded before they existed
+            await conn.execute("ALTER TABLE qa_pairs ADD COLUMN IF NOT EXISTS content_hash TEXT")
+            await conn.execute("""
+                UPDATE qa_pairs
+                SET content_hash = encode(sha256(convert_to(question || chr(31) || answer, 'UTF8')), 'hex')
+                WHERE content_hash IS NULL
+            """)
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS qa_source_content_hash_idx 
+                ON qa_pairs (source, content_hash)
+            """)
+            
+            # Case-insensitive QA ID lookups
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS qa_qa_id_upper_idx 
+                ON qa_pairs (UPPER(qa_id))
+            """)
+            
+            # Normalized-question hashes for exact-match lookups
+            await conn.execute("ALTER TABLE qa_pairs ADD COLUMN IF NOT EXISTS question_key TEXT")
+            missing = await conn.fetch("SELECT id, question FROM qa_pairs WHERE question_key IS NULL")
+            if missing:
+                await conn.executemany(
+                    "UPDATE qa_pairs SET question_key = $1 WHERE id = $2",
+                    [(question_key(row["question"]), row["id"]) for row in missing]
+                )
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS qa_question_key_idx 
+                ON qa_pairs (question_key)
+            """)
+            
+            # Rows sharing an answer form an answer group with one canonical row
+            await conn.execute("ALTER TABLE qa_pairs ADD COLUMN IF NOT EXISTS answer_group TEXT")
+            await conn.execute(
+                "ALTER TABLE qa_pairs ADD COLUMN IF NOT EXISTS answer_is_canonical BOOLEAN NOT NULL DEFAULT TRUE"
             )
-        """)
+            missing = await conn.fetch("SELECT id, answer FROM qa_pairs WHERE answer_group IS NULL")
+            if missing:
+                await conn.executemany(
+                    "UPDATE qa_pairs SET answer_group = $1 WHERE id = $2",
+                    [(answer_key(row["answer"]), row["id"]) for row in missing]
+                )
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS qa_answer_group_idx 
+                ON qa_pairs (answer_group)
+            """)
+            
+            # Full-text index for lexical and hybrid retrieval (questions weighted above answers)
+            await conn.execute("""
+                ALTER TABLE qa_pairs ADD COLUMN IF NOT EXISTS search_tsv tsvector
+                GENERATED ALWAYS AS (
+                    setweight(to_tsvector('english', question), 'A') ||
+                    setweight(to_tsvector('english', answer), 'B')
+                ) STORED
+            """)
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS qa_search_tsv_idx 
+                ON qa_pairs USING GIN (search_tsv)
+            """)
+            
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS qa_sync_manifest (
+                    source TEXT PRIMARY KEY,
+                    content_digest TEXT NOT NULL,
+                    row_count INTEGER NOT NULL,
+                    added INTEGER NOT NULL DEFAULT 0,
+                    updated INTEGER NOT NULL DEFAULT 0,
+                    removed INTEGER NOT NULL DEFAULT 0,
+                    synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
         
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS qa_question_embedding_idx 
-            ON qa_pairs USING ivfflat (question_embedding vector_cosine_ops)
-            WITH (lists = 100)
-        """)
+        # Loads collapse the groups they touch; only a load interrupted before that leaves work here
+        async with self._acquire() as conn:
+            uncollapsed = await conn.fetchval("""
+                SELECT EXISTS (
+                    SELECT 1 FROM qa_pairs GROUP BY answer_group
+                    HAVING COUNT(*) FILTER (WHERE answer_is_canonical) <> 1
+                )
+            """)
+        if uncollapsed:
+            await self.collapse_answer_groups()
+        await self.ensure_vector_indexes()
+        await self.refresh_exact_index(force=True)
+    
+    def _vector_index_ddl(self, name: str, column: str, predicate: str, index_type: str, row_count: int) -> str:
+        """CREATE INDEX statement for one embedding column."""
+        if index_type == "hnsw":
+            options = (f"m = {int(VECTOR_INDEX_CONFIG['hnsw_m'])}, "
+                       f"ef_construction = {int(VECTOR_INDEX_CONFIG['hnsw_ef_construction'])}")
+        else:
+            options = f"lists = {ivfflat_lists(row_count)}"
+        where = f" WHERE {predicate}" if predicate else ""
+        return (f"CREATE INDEX CONCURRENTLY {name} ON qa_pairs "
+                f"USING {index_type} ({column} vector_cosine_ops) WITH ({options}){where}")
+    
+    async def _current_index_types(self, conn) -> Dict[str, str]:
+        """Access method (hnsw, ivfflat, ...) of each existing ANN index, "invalid" for a failed build."""
+        rows = await conn.fetch("""
+            SELECT c.relname, am.amname, i.indisvalid
+            FROM pg_class c
+            JOIN pg_am am ON am.oid = c.relam
+            JOIN pg_index i ON i.indexrelid = c.oid
+            WHERE c.relkind = 'i' AND c.relname = ANY($1::text[])
+        """, [name for name, _, _ in VECTOR_INDEXES] + RETIRED_VECTOR_INDEXES)
+        return {row["relname"]: row["amname"] if row["indisvalid"] else "invalid" for row in rows}
+    
+    async def ensure_vector_indexes(self, rebuild: bool = False) -> Dict[str, str]:
+        """Create or replace the ANN indexes so they match VECTOR_INDEX_CONFIG.
         
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS qa_answer_embedding_idx 
-            ON qa_pairs USING ivfflat (answer_embedding vector_cosine_ops)
-            WITH (lists = 100)
-        """)
+        HNSW is built straight away since it needs no training data. IVFFlat
+        clusters on the rows present at build time, so it is only built once
+        the table has data, with lists sized from the row count. Replacement
+        indexes are built concurrently and swapped in, so searches keep
+        working during a rebuild.
+        """
+        index_type = VECTOR_INDEX_CONFIG["type"]
         
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS qa_qa_id_idx 
-            ON qa_pairs (qa_id)
-        """)
+        async with self._acquire() as conn:
+            # Serialize index maintenance across workers starting at the same time. Poll
+            # rather than block: a session waiting inside pg_advisory_lock holds a
+            # snapshot that CREATE INDEX CONCURRENTLY would wait on.
+            while not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext('qa_pairs_vector_indexes'))"):
+                await asyncio.sleep(0.5)
+            try:
+                actions = await self._apply_vector_indexes(conn, index_type, rebuild)
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock(hashtext('qa_pairs_vector_indexes'))")
+        
+        built = {name: action for name, action in actions.items() if action.startswith("built")}
+        if built:
+            print(f"🧭 Vector indexes: {built}")
+        return actions
+    
+    async def _apply_vector_indexes(self, conn, index_type: str, rebuild: bool) -> Dict[str, str]:
+        actions = {}
+        timeout = VECTOR_INDEX_CONFIG["build_timeout_seconds"]
+        current = await self._current_index_types(conn)
+        row_count = await conn.fetchval("SELECT COUNT(*) FROM qa_pairs", timeout=timeout)
+        
+        for name in RETIRED_VECTOR_INDEXES:
+            if name in current:
+                await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}", timeout=timeout)
+                actions[name] = "dropped"
+        
+        for name, column, predicate in VECTOR_INDEXES:
+            existing = current.get(name)
+            
+            if index_type == "none":
+                if existing:
+                    await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}", timeout=timeout)
+                    actions[name] = "dropped"
+                continue
+            
+            if existing == index_type and not rebuild:
+                actions[name] = "ok"
+                continue
+            
+            if index_type == "ivfflat" and row_count == 0:
+                actions[name] = "deferred until data is loaded"
+                continue
+            
+            # Build under a temporary name, then swap it in
+            staging = f"{name}_rebuild"
+            await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {staging}", timeout=timeout)
+            await conn.execute(self._vector_index_ddl(staging, column, predicate, index_type, row_count), timeout=timeout)
+            await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}", timeout=timeout)
+            await conn.execute(f"ALTER INDEX {staging} RENAME TO {name}", timeout=timeout)
+            actions[name] = f"built {index_type}"
+        
+        return actions
+    
+    async def rebuild_vector_indexes(self) -> Dict[str, str]:
+        """Rebuild the ANN indexes, e.g. after large loads or changing index parameters."""
+        return await self.ensure_vector_indexes(rebuild=True)
+    
+    async def _embed_and_copy(self, conn, qa_pairs: List[Dict]) -> Dict[str, Any]:
+        """Embed pairs through the EmbeddingPipeline, COPYing each batch as it finishes.
+        
+        The caller owns the transaction on conn.
+        """
+        pipeline = EmbeddingPipeline(self.embeddings, self.embedding_model)
+        copy_seconds = 0.0
+        
+        # Answers already in the table reuse their embedding and join their group
+        existing = await conn.fetch("""
+            SELECT DISTINCT ON (answer) answer, answer_group, answer_embedding
+            FROM qa_pairs
+            WHERE answer = ANY($1::text[]) AND answer_embedding IS NOT NULL
+            ORDER BY answer, answer_is_canonical DESC, id
+        """, list({qa["answer"] for qa in qa_pairs}))
+        known_answers = {row["answer"]: row["answer_embedding"] for row in existing}
+        known_groups = {row["answer"]: row["answer_group"] for row in existing}
+        
+        async def write_batch(batch, question_embeddings, answer_embeddings):
+            nonlocal copy_seconds
+            copy_start = time.perf_counter()
+            await conn.copy_records_to_table(
+                "qa_pairs",
+                records=[
+                    (
+                        qa.get("qa_id"),
+                        qa["question"],
+                        qa["answer"],
+                        q_emb,
+                        a_emb,
+                        qa.get("source", "unknown"),
+                        qa.get("content_hash") or content_hash(qa["question"], qa["answer"]),
+                        question_key(qa["question"]),
+                        known_groups.get(qa["answer"]) or answer_key(qa["answer"])
+                    )
+                    for qa, q_emb, a_emb in zip(batch, question_embeddings, answer_embeddings)
+                ],
+                columns=QA_COPY_COLUMNS
+            )
+            copy_seconds += time.perf_counter() - copy_start
         
-        conn.commit()
-        cur.close()
-        conn.close()
+        stats = await pipeline.run(qa_pairs, write_batch, known_answers)
+        stats["copy_rows_per_sec"] = round(len(qa_pairs) / copy_seconds, 1) if copy_seconds else None
+        return stats
     
     async def add_qa_pairs(self, qa_pairs: List[Dict]):
-        """Add Q&A pairs to database"""
+        """Add Q&A pairs to database.
+        
+        Embedding batches run concurrently through the EmbeddingPipeline and
+        each finished batch is COPYed in while later ones are still embedding.
+        All batches share one transaction so a failed load leaves no partial rows.
+        """
         if not qa_pairs:
             return
         
-        questions = [qa["question"] for qa in qa_pairs]
-        answers = [qa["answer"] for qa in qa_pairs]
+        start = time.perf_counter()
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                pipeline_stats = await self._embed_and_copy(conn, qa_pairs)
         
-        question_embeddings = await self.embeddings.aembed_documents(questions)
-        answer_embeddings = await self.embeddings.aembed_documents(answers)
+        elapsed = time.perf_counter() - start
+        stats = {
+            "rows": len(qa_pairs),
+            "seconds": round(elapsed, 3),
+            "rows_per_sec": round(len(qa_pairs) / elapsed, 1) if elapsed else None,
+            **pipeline_stats
+        }
+        print(f"✅ Added {stats['rows']} Q&A pairs in {stats['seconds']}s "
+              f"({stats['rows_per_sec']} rows/sec, COPY {stats['copy_rows_per_sec']} rows/sec, "
+              f"{stats['requests']} embedding requests, {stats['answers_reused']} answers reused, "
+              f"{stats['retries']} retries)")
+        await self.collapse_answer_groups()
+        await self.refresh_exact_index()
+        return stats
+    
+    @staticmethod
+    async def _lock_sync(conn):
+        """Take the knowledge-base load lock for the rest of conn's transaction.
         
-        conn = psycopg2.connect(self.connection_string)
-        cur = conn.cursor()
+        Waits out another worker's sync, which embeds inside the lock, so the
+        pool's command_timeout doesn't apply.
+        """
+        await conn.execute(
+            "SELECT pg_advisory_xact_lock(hashtext('qa_pairs_sync'))", timeout=KB_SYNC_LOCK_TIMEOUT_SECONDS
+        )
+    
+    async def load_snapshot(self, snapshot: Dict[str, Any], source_root: str) -> Dict[str, Any]:
+        """Bulk-load a pre-computed embedding snapshot without calling the embeddings API.
         
-        for qa, q_emb, a_emb in zip(qa_pairs, question_embeddings, answer_embeddings):
-            cur.execute("""
-                INSERT INTO qa_pairs (qa_id, question, answer, question_embedding, answer_embedding, source)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (
-                qa.get("qa_id"),
+        Snapshot sources are CSV file names and are resolved against source_root
+        so they match the paths used by sync_qa_pairs. Skipped (with
+        "skipped": True) if another worker filled the table first.
+        """
+        start = time.perf_counter()
+        question_embeddings = snapshot["question_embeddings"]
+        answer_embeddings = snapshot["answer_embeddings"]
+        
+        records = (
+            (
+                qa["qa_id"],
                 qa["question"],
                 qa["answer"],
-                q_emb,
-                a_emb,
-                qa.get("source", "unknown")
-            ))
+                question_embeddings[i],
+                answer_embeddings[i],
+                os.path.join(source_root, qa["source"]),
+                qa["content_hash"],
+                question_key(qa["question"]),
+                answer_key(qa["answer"])
+            )
+            for i, qa in enumerate(snapshot["records"])
+        )
         
-        conn.commit()
-        cur.close()
-        conn.close()
-        print(f"✅ Added {len(qa_pairs)} Q&A pairs")
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                # Workers starting together on an empty table would each load the snapshot
+                await self._lock_sync(conn)
+                if await conn.fetchval("SELECT EXISTS (SELECT 1 FROM qa_pairs)"):
+                    return {"rows": 0, "seconds": 0.0, "skipped": True}
+                await conn.copy_records_to_table("qa_pairs", records=records, columns=QA_COPY_COLUMNS)
+        
+        elapsed = time.perf_counter() - start
+        rows = len(snapshot["records"])
+        print(f"📦 Loaded {rows} Q&A pairs from {snapshot['model']} snapshot in {elapsed:.2f}s "
+              f"({round(rows / elapsed, 1) if elapsed else rows} rows/sec)")
+        await self.collapse_answer_groups()
+        await self.refresh_exact_index()
+        return {"rows": rows, "seconds": round(elapsed, 3)}
     
-    async def get_qa_count(self):
-        """Get total number of Q&A pairs"""
-        conn = psycopg2.connect(self.connection_string)
-        cur = conn.cursor()
+    async def sync_qa_pairs(self, source: str, qa_pairs: List[Dict]) -> Dict[str, Any]:
+        """Bring the rows for source in line with qa_pairs, embedding only the diff.
+        
+        Rows are matched on content_hash: new hashes are embedded and inserted,
+        hashes no longer present are deleted, and rows whose content is
+        unchanged but whose qa_id moved are relabelled without re-embedding.
+        A per-source manifest digest lets an unchanged file skip the diff.
+        """
+        desired: Dict[str, Dict] = {}
+        for qa in qa_pairs:
+            desired.setdefault(qa["content_hash"], qa)
+        digest = hashlib.sha256("".join(sorted(desired)).encode("utf-8")).hexdigest()
+        
+        async with self._acquire() as conn:
+            manifest_digest = await conn.fetchval(
+                "SELECT content_digest FROM qa_sync_manifest WHERE source = $1", source
+            )
+            if manifest_digest == digest:
+                return {"source": source, "unchanged": True, "added": 0, "updated": 0, "removed": 0}
+            
+            async with conn.transaction():
+                # One sync at a time across workers; re-read the manifest in case one just finished
+                await self._lock_sync(conn)
+                manifest_digest = await conn.fetchval(
+                    "SELECT content_digest FROM qa_sync_manifest WHERE source = $1", source
+                )
+                if manifest_digest == digest:
+                    return {"source": source, "unchanged": True, "added": 0, "updated": 0, "removed": 0}
+                
+                existing = await conn.fetch(
+                    "SELECT id, qa_id, content_hash FROM qa_pairs WHERE source = $1", source
+                )
+                
+                existing_by_hash: Dict[str, Any] = {}
+                to_delete = []
+                for row in existing:
+                    if row["content_hash"] in existing_by_hash:
+                        to_delete.append(row["id"])  # duplicate of a row we keep
+                    else:
+                        existing_by_hash[row["content_hash"]] = row
+                
+                removed = [row for h, row in existing_by_hash.items() if h not in desired]
+                to_delete.extend(row["id"] for row in removed)
+                to_add = [qa for h, qa in desired.items() if h not in existing_by_hash]
+                to_relabel = [
+                    (desired[h]["qa_id"], row["id"])
+                    for h, row in existing_by_hash.items()
+                    if h in desired and desired[h]["qa_id"] != row["qa_id"]
+                ]
+                
+                # An added row that reuses a removed row's qa_id is an edit of that row
+                removed_ids = {row["qa_id"] for row in removed}
+                updated = sum(1 for qa in to_add if qa["qa_id"] in removed_ids)
+                
+                if to_delete:
+                    await conn.execute("DELETE FROM qa_pairs WHERE id = ANY($1::int[])", to_delete)
+                if to_relabel:
+                    await conn.executemany("UPDATE qa_pairs SET qa_id = $1 WHERE id = $2", to_relabel)
+                if to_add:
+                    await self._embed_and_copy(conn, to_add)
+                
+                stats = {
+                    "source": source,
+                    "unchanged": False,
+                    "added": len(to_add) - updated,
+                    "updated": updated,
+                    "removed": len(to_delete) - updated
+                }
+                await conn.execute("""
+                    INSERT INTO qa_sync_manifest (source, content_digest, row_count, added, updated, removed, synced_at)
+                    VALUES ($1, $2, $3, $4, $5, $6, CURRENT_TIMESTAMP)
+                    ON CONFLICT (source) DO UPDATE SET
+                        content_digest = EXCLUDED.content_digest,
+                        row_count = EXCLUDED.row_count,
+                        added = EXCLUDED.added,
+                        updated = EXCLUDED.updated,
+                        removed = EXCLUDED.removed,
+                        synced_at = EXCLUDED.synced_at
+                """, source, digest, len(desired), stats["added"], stats["updated"], stats["removed"])
+        
+        print(f"🔄 Synced {source}: +{stats['added']} ~{stats['updated']} -{stats['removed']} "
+              f"({len(to_add)} rows embedded)")
+        if to_add:
+            await self.collapse_answer_groups()
+        elif to_delete:
+            # A deleted row may have been its group's canonical row; nothing new to merge
+            await self.collapse_answer_groups(merge=False)
+        await self.refresh_exact_index()
+        return stats
+    
+    async def collapse_answer_groups(self, merge: bool = True) -> Dict[str, Any]:
+        """Merge answer groups whose answers are near-duplicates and pick one canonical row per group.
         
-        cur.execute("SELECT COUNT(*) FROM qa_pairs")
-        count = cur.fetchone()[0]
+        Groups start out as exact (normalized) answer matches. Their
+        canonical answer embeddings are then clustered greedily, oldest group
+        first: every group within ANSWER_GROUP_THRESHOLD cosine similarity of
+        a leader is folded into it. The lowest id in each group becomes the
+        canonical row, the only one kept in the answer ANN index. With
+        merge=False only the canonical rows are re-picked (after deletes).
+        Called by the loaders once rows were inserted, not on every startup.
+        """
+        threshold = ANSWER_GROUP_CONFIG["similarity_threshold"]
+        merge = merge and threshold <= 1
+        
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                # One worker at a time; others see the result once it commits
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext('qa_pairs_answer_groups'))")
+                
+                leaders = await conn.fetch("""
+                    SELECT DISTINCT ON (answer_group) id, answer_group, answer_embedding
+                    FROM qa_pairs
+                    WHERE answer_embedding IS NOT NULL
+                    ORDER BY answer_group, id
+                """) if merge else []
+                
+                merges = []
+                if len(leaders) > 1:
+                    order = sorted(range(len(leaders)), key=lambda i: leaders[i]["id"])
+                    groups = [leaders[i]["answer_group"] for i in order]
+                    matrix = np.array([leaders[i]["answer_embedding"] for i in order], dtype=np.float32)
+                    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                    norms[norms == 0] = 1.0
+                    matrix /= norms
+                    
+                    # Every group before i is assigned by the time i is reached, so a block of
+                    # leaders only needs its similarities to itself and the groups after it
+                    count = len(groups)
+                    block = max(1, _ANSWER_GROUP_BLOCK_CELLS // count)
+                    assigned = np.zeros(count, dtype=bool)
+                    for start in range(0, count, block):
+                        if assigned[start:start + block].all():
+                            continue
+                        similarities = matrix[start:start + block] @ matrix[start:].T >= threshold
+                        for offset, row in enumerate(similarities):
+                            i = start + offset
+                            if assigned[i]:
+                                continue
+                            members = start + np.flatnonzero(row & ~assigned[start:])
+                            assigned[members] = True
+                            assigned[i] = True
+                            merges.extend((groups[i], groups[j]) for j in members if j != i)
+                
+                if merges:
+                    await conn.executemany(
+                        "UPDATE qa_pairs SET answer_group = $1 WHERE answer_group = $2", merges
+                    )
+                
+                await conn.execute("""
+                    UPDATE qa_pairs p
+                    SET answer_is_canonical = (p.id = g.first_id)
+                    FROM (
+                        SELECT answer_group, MIN(id) AS first_id
+                        FROM qa_pairs
+                        GROUP BY answer_group
+                    ) g
+                    WHERE p.answer_group = g.answer_group
+                      AND p.answer_is_canonical IS DISTINCT FROM (p.id = g.first_id)
+                """)
+                counts = await conn.fetchrow("""
+                    SELECT COUNT(*) AS rows, COUNT(*) FILTER (WHERE answer_is_canonical) AS groups
+                    FROM qa_pairs
+                """)
         
-        cur.close()
-        conn.close()
-        return count
+        stats = {"rows": counts["rows"], "answer_groups": counts["groups"], "merged": len(merges)}
+        if merges:
+            print(f"🧩 Collapsed {stats['rows']} Q&A pairs into {stats['answer_groups']} distinct answers "
+                  f"({len(merges)} near-duplicate groups merged)")
+        return stats
+    
+    async def get_qa_count(self):
+        """Get total number of Q&A pairs"""
+        async with self._acquire() as conn:
+            return await conn.fetchval("SELECT COUNT(*) FROM qa_pairs")
     
     async def check_file_loaded(self, csv_path: str):
         """Check if a specific CSV file has been loaded"""
-        conn = psycopg2.connect(self.connection_string)
-        cur = conn.cursor()
+        async with self._acquire() as conn:
+            loaded = await conn.fetchval("""
+                SELECT EXISTS (SELECT 1 FROM qa_pairs WHERE source = $1)
+            """, csv_path)
+        return loaded
+    
+    async def _table_version(self, conn):
+        """Cheap change stamp for qa_pairs: row count, max id and each row's qa_id and answer grouping.
+        
+        Rows are hashed with their id, so relabelling qa_ids (sync_qa_pairs
+        moving a qa_id between unchanged rows) changes the stamp too.
+        """
+        row = await conn.fetchrow("""
+            SELECT COUNT(*) AS rows, COALESCE(MAX(id), 0) AS max_id,
+                   COALESCE(SUM(hashtext(
+                       id || ':' || COALESCE(qa_id::text, '') || ':' || answer_group || ':' || answer_is_canonical::text
+                   )), 0) AS grouping
+            FROM qa_pairs
+        """)
+        return (row["rows"], row["max_id"], row["grouping"])
+    
+    async def refresh_exact_index(self, force: bool = False):
+        """Reload the in-memory normalized-question map if qa_pairs changed.
+        
+        Questions that appear with more than one distinct answer are left out,
+        so an exact match is always unambiguous.
+        """
+        async with self._acquire() as conn:
+            version = await self._table_version(conn)
+            self._exact_checked_at = time.monotonic()
+            if version == self._exact_version and not force:
+                return
+            records = await conn.fetch("""
+                SELECT id, qa_id, question, answer, source, question_key
+                FROM qa_pairs
+                ORDER BY id
+            """)
         
-        cur.execute("""
-            SELECT COUNT(*) FROM qa_pairs 
-            WHERE source = %s
-        """, (csv_path,))
+        index: Dict[str, Dict[str, Any]] = {}
+        ambiguous = set()
+        for record in records:
+            key = record["question_key"] or question_key(record["question"])
+            existing = index.get(key)
+            if existing is None:
+                index[key] = {k: record[k] for k in ("id", "qa_id", "question", "answer", "source")}
+            elif existing["answer"] != record["answer"]:
+                ambiguous.add(key)
+        for key in ambiguous:
+            del index[key]
         
-        count = cur.fetchone()[0]
-        cur.close()
-        conn.close()
-        return count > 0
+        self._exact_index = index
+        self._exact_version = version
+    
+    async def search_exact(self, question: str):
+        """Return the row whose normalized question equals this one, with no embedding or ANN call."""
+        if self._exact_index is None or time.monotonic() - self._exact_checked_at > KB_MEMORY_REFRESH_SECONDS:
+            await self.refresh_exact_index()
+        
+        result = self._exact_index.get(question_key(question))
+        if result is None:
+            return None
+        return {**result, "similarity": 1.0, "final_score": 1.0, "match_type": "exact"}
     
     async def search_by_qa_id(self, qa_id: str):
         """Search by QA ID"""
-        conn = psycopg2.connect(self.connection_string)
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        cur.execute("""
-            SELECT qa_id, question, answer, source
-            FROM qa_pairs
-            WHERE UPPER(qa_id) = UPPER(%s)
-            LIMIT 1
-        """, (qa_id,))
-        
-        result = cur.fetchone()
-        cur.close()
-        conn.close()
+        async with self._acquire() as conn:
+            result = await conn.fetchrow("""
+                SELECT qa_id, question, answer, source
+                FROM qa_pairs
+                WHERE UPPER(qa_id) = UPPER($1)
+                LIMIT 1
+            """, qa_id)
         
         return dict(result) if result else None
     
+    async def embed_query(self, query: str) -> List[float]:
+        """Embed a search query, serving repeated questions from the cache."""
+        embedding = await self.embedding_cache.get(query)
+        if embedding is None:
+            embedding = await self.embeddings.aembed_query(query)
+            await self.embedding_cache.put(query, embedding)
+        return embedding
+    
     async def search_question(self, query: str, k: int = 5):
         """Search by question similarity"""
-        query_embedding = await self.embeddings.aembed_query(query)
-        
-        conn = psycopg2.connect(self.connection_string)
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        embedding_str = '[' + ','.join(map(str, query_embedding)) + ']'
-        
-        cur.execute("""
-            SELECT 
-                qa_id,
-                question, 
-                answer,
-                source,
-                1 - (question_embedding <=> %s::vector) as similarity
-            FROM qa_pairs
-            ORDER BY question_embedding <=> %s::vector
-            LIMIT %s
-        """, (embedding_str, embedding_str, k))
+        query_embedding = await self.embed_query(query)
         
-        results = cur.fetchall()
-        cur.close()
-        conn.close()
+        async with self._acquire() as conn:
+            results = await conn.fetch("""
+                SELECT 
+                    qa_id,
+                    question, 
+                    answer,
+                    source,
+                    1 - (question_embedding <=> $1::vector) as similarity
+                FROM qa_pairs
+                ORDER BY question_embedding <=> $1::vector
+                LIMIT $2
+            """, query_embedding, k)
         
         return [dict(result) for result in results]
     
     async def search_answer(self, query: str, k: int = 5):
         """Search by answer similarity"""
-        query_embedding = await self.embeddings.aembed_query(query)
+        query_embedding = await self.embed_query(query)
         
-        conn = psycopg2.connect(self.connection_string)
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+        async with self._acquire() as conn:
+            results = await conn.fetch("""
+                SELECT 
+                    qa_id,
+                    question, 
+                    answer,
+                    source,
+                    1 - (answer_embedding <=> $1::vector) as similarity
+                FROM qa_pairs
+                WHERE answer_is_canonical
+                ORDER BY answer_embedding <=> $1::vector
+                LIMIT $2
+            """, query_embedding, k)
         
-        embedding_str = '[' + ','.join(map(str, query_embedding)) + ']'
-        
-        cur.execute("""
-            SELECT 
-                qa_id,
-                question, 
-                answer,
-                source,
-                1 - (answer_embedding <=> %s::vector) as similarity
-            FROM qa_pairs
-            ORDER BY answer_embedding <=> %s::vector
-            LIMIT %s
-        """, (embedding_str, embedding_str, k))
+        return [dict(result) for result in results]
+    
+    async def search_lexical(self, query: str, k: int = 5):
+        """Full-text search over questions and answers, no embedding needed.
         
-        results = cur.fetchall()
-        cur.close()
-        conn.close()
+        Any query term may match (OR semantics) and rows are ranked by
+        ts_rank_cd, scaled to 0-1. question_match is true when every query
+        term appears in the row's question.
+        """
+        async with self._acquire() as conn:
+            results = await conn.fetch("""
+                WITH terms AS (
+                    SELECT plainto_tsquery('english', $1) AS all_terms,
+                           NULLIF(replace(plainto_tsquery('english', $1)::text, '&', '|'), '')::tsquery AS any_term
+                )
+                SELECT p.id, p.qa_id, p.question, p.answer, p.source, p.answer_group,
+                       ts_rank_cd(p.search_tsv, t.any_term, 32) AS similarity,
+                       to_tsvector('english', p.question) @@ t.all_terms AS question_match
+                FROM qa_pairs p, terms t
+                WHERE p.search_tsv @@ t.any_term
+                ORDER BY similarity DESC
+                LIMIT $2
+            """, query, k)
         
         return [dict(result) for result in results]
     
-    async def search_dual_ranked(self, query: str, k: int = 5):
-        """Dual search with ranking - questions weighted higher than answers"""
-        # Search both questions and answers
-        question_results = await self.search_question(query, k)
-        answer_results = await self.search_answer(query, k)
-        
-        # Combine and re-rank with weights
-        combined_results = {}
-        
-        # Add question results with higher weight (0.7)
-        for result in question_results:
-            qa_id = result['qa_id']
-            weighted_score = result['similarity'] * 0.7
-            combined_results[qa_id] = {
-                **result,
-                'final_score': weighted_score,
-                'match_type': 'question'
-            }
+    @staticmethod
+    def _distinct_answers(results: List[Dict]) -> List[Dict]:
+        """Keep the best-ranked row of each answer group."""
+        seen = set()
+        distinct = []
+        for result in results:
+            if result["answer_group"] not in seen:
+                seen.add(result["answer_group"])
+                distinct.append(result)
+        return distinct
+    
+    def _lexical_is_confident(self, query: str, results: List[Dict]) -> bool:
+        """A short query whose every term is in the top question, clearly ahead of the runner-up."""
+        if not results or len(query.split()) > HYBRID_SEARCH_CONFIG["fast_path_max_terms"]:
+            return False
+        top = results[0]
+        if not top["question_match"]:
+            return False
+        return len(results) == 1 or top["similarity"] >= HYBRID_SEARCH_CONFIG["fast_path_margin"] * results[1]["similarity"]
+    
+    async def search_hybrid(self, query: str, k: int = 5):
+        """Fuse lexical and dual-ranked vector results with reciprocal rank fusion.
         
-        # Add answer results with lower weight (0.3)
-        for result in answer_results:
-            qa_id = result['qa_id']
-            weighted_score = result['similarity'] * 0.3
-            
-            if qa_id in combined_results:
-                # Boost score if found in both
-                combined_results[qa_id]['final_score'] += weighted_score
-                combined_results[qa_id]['match_type'] = 'both'
+        Short keyword queries with a confident lexical match skip the
+        embedding call entirely. Otherwise rows keep their vector
+        similarity, final_score and match_type and are ordered by rrf_score.
+        """
+        candidates = max(k, HYBRID_SEARCH_CONFIG["candidates"])
+        rrf_k = HYBRID_SEARCH_CONFIG["rrf_k"]
+        
+        lexical_results = self._distinct_answers(await self.search_lexical(query, candidates))
+        if self._lexical_is_confident(query, lexical_results):
+            return [
+                {**result, "final_score": result["similarity"], "match_type": "lexical", "rrf_score": None}
+                for result in lexical_results[:k]
+            ]
+        
+        vector_results = await self.search_dual_ranked(query, candidates)
+        
+        # Fuse per answer group so each answer appears once
+        fused: Dict[Any, Dict[str, Any]] = {}
+        for rank, result in enumerate(vector_results, 1):
+            fused[result["answer_group"]] = {**result, "rrf_score": 1.0 / (rrf_k + rank)}
+        for rank, result in enumerate(lexical_results, 1):
+            score = 1.0 / (rrf_k + rank)
+            if result["answer_group"] in fused:
+                fused[result["answer_group"]]["rrf_score"] += score
             else:
-                combined_results[qa_id] = {
+                fused[result["answer_group"]] = {
                     **result,
-                    'final_score': weighted_score,
-                    'match_type': 'answer'
+                    "final_score": 0.0,
+                    "match_type": "lexical",
+                    "rrf_score": score
                 }
         
-        # Sort by final score and return top k
-        sorted_results = sorted(
-            combined_results.values(), 
-            key=lambda x: x['final_score'], 
-            reverse=True
-        )[:k]
+        return sorted(fused.values(), key=lambda x: x["rrf_score"], reverse=True)[:k]
+    
+    async def search(self, query: str, k: int = 5):
+        """Search the knowledge base using the configured RAG_RETRIEVAL_MODE."""
+        if RAG_RETRIEVAL_MODE == "hybrid":
+            return await self.search_hybrid(query, k)
+        return await self.search_dual_ranked(query, k)
+    
+    @asynccontextmanager
+    async def _ann_settings(self, conn, ef_search: int = None, probes: int = None):
+        """Apply per-query ANN search settings for the duration of the block."""
+        if ef_search is None and probes is None:
+            yield
+            return
+        
+        async with conn.transaction():
+            await conn.execute(
+                "SELECT set_config('hnsw.ef_search', $1, true), set_config('ivfflat.probes', $2, true)",
+                str(ef_search or VECTOR_INDEX_CONFIG["hnsw_ef_search"]),
+                str(probes or VECTOR_INDEX_CONFIG["ivfflat_probes"])
+            )
+            yield
+    
+    async def search_dual_ranked(self, query: str, k: int = 5, ef_search: int = None, probes: int = None):
+        """Dual search with ranking - questions weighted higher than answers.
         
-        return sorted_results
+        The query is embedded once and both candidate sets plus the weighted
+        fusion are computed in a single statement. Results are k distinct
+        answers: question hits are collapsed to the best-matching question
+        per answer group, and answer hits come from canonical rows only.
+        ef_search (HNSW) and probes (IVFFlat) override the pool defaults for
+        this query only, trading latency for recall.
+        """
+        query_embedding = await self.embed_query(query)
+        question_candidates = k * ANSWER_GROUP_CONFIG["question_candidate_factor"]
+        
+        async with self._acquire() as conn, self._ann_settings(conn, ef_search, probes):
+            results = await conn.fetch("""
+                WITH question_candidates AS (
+                    SELECT id, answer_group, 1 - (question_embedding <=> $1::vector) AS similarity
+                    FROM qa_pairs
+                    ORDER BY question_embedding <=> $1::vector
+                    LIMIT $5
+                ),
+                question_hits AS (
+                    SELECT DISTINCT ON (answer_group) id, answer_group, similarity
+                    FROM question_candidates
+                    ORDER BY answer_group, similarity DESC
+                ),
+                answer_hits AS (
+                    SELECT id, answer_group, 1 - (answer_embedding <=> $1::vector) AS similarity
+                    FROM qa_pairs
+                    WHERE answer_is_canonical
+                    ORDER BY answer_embedding <=> $1::vector
+                    LIMIT $2
+                ),
+                fused AS (
+                    SELECT
+                        COALESCE(q.id, a.id) AS id,
+                        COALESCE(q.similarity, a.similarity) AS similarity,
+                        COALESCE(q.similarity, 0) * $3 + COALESCE(a.similarity, 0) * $4 AS final_score,
+                        CASE
+                            WHEN q.id IS NOT NULL AND a.id IS NOT NULL THEN 'both'
+                            WHEN q.id IS NOT NULL THEN 'question'
+                            ELSE 'answer'
+                        END AS match_type
+                    FROM question_hits q
+                    FULL OUTER JOIN answer_hits a ON q.answer_group = a.answer_group
+                )
+                SELECT p.id, p.qa_id, p.question, p.answer, p.source, p.answer_group,
+                       f.similarity, f.final_score, f.match_type
+                FROM fused f
+                JOIN qa_pairs p ON p.id = f.id
+                ORDER BY f.final_score DESC
+                LIMIT $2
+            """, query_embedding, k, self.QUESTION_WEIGHT, self.ANSWER_WEIGHT, question_candidates)
+        
+        return [dict(result) for result in results]
+
+class NumpyVectorStore(PGVectorStore):
+    """PGVectorStore whose similarity search runs on in-process NumPy matrices.
+    
+    Postgres stays the source of truth for loading, syncing and lexical
+    lookups; the question and answer embeddings are mirrored into one
+    row-normalized float32 matrix so a dual-ranked search is a single
+    matrix-vector product plus argpartition. Only canonical rows compete on
+    answer similarity, mirroring the partial answer index. The mirror is rebuilt after
+    local writes and whenever the table's (row count, max id) version
+    changes, which is checked at most every KB_MEMORY_REFRESH_SECONDS.
+    """
+    
+    def __init__(self, connection_string: str, embedding_model: str):
+        super().__init__(connection_string, embedding_model)
+        self._rows: List[Dict[str, Any]] = []
+        self._matrix = None  # question rows stacked on top of answer rows
+        self._canonical = None  # rows whose answer represents their answer group
+        self._version = None
+        self._checked_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+    
+    @staticmethod
+    def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+    
+    def _load_matrices(self, rows: List[Dict[str, Any]], canonical, question_embeddings, answer_embeddings):
+        """Swap in a new in-memory index."""
+        questions = self._normalize_rows(np.asarray(question_embeddings, dtype=np.float32))
+        answers = self._normalize_rows(np.asarray(answer_embeddings, dtype=np.float32))
+        self._matrix = np.ascontiguousarray(np.vstack([questions, answers]))
+        self._canonical = np.asarray(canonical, dtype=bool)
+        self._rows = rows
+    
+    async def refresh(self, force: bool = False):
+        """Reload the matrices from Postgres if the table changed."""
+        async with self._refresh_lock:
+            async with self._acquire() as conn:
+                version = await self._table_version(conn)
+                self._checked_at = time.monotonic()
+                if version == self._version and not force:
+                    return
+                
+                records = await conn.fetch("""
+                    SELECT id, qa_id, question, answer, source, answer_group, answer_is_canonical,
+                           question_embedding, answer_embedding
+                    FROM qa_pairs
+                    WHERE question_embedding IS NOT NULL AND answer_embedding IS NOT NULL
+                    ORDER BY id
+                """)
+            
+            rows = [
+                {"id": r["id"], "qa_id": r["qa_id"], "question": r["question"], "answer": r["answer"],
+                 "source": r["source"], "answer_group": r["answer_group"]}
+                for r in records
+            ]
+            dim = len(records[0]["question_embedding"]) if records else 768
+            self._load_matrices(
+                rows,
+                [r["answer_is_canonical"] for r in records],
+                np.array([r["question_embedding"] for r in records], dtype=np.float32).reshape(-1, dim),
+                np.array([r["answer_embedding"] for r in records], dtype=np.float32).reshape(-1, dim)
+            )
+            self._version = version
+            print(f"🧮 Loaded {len(rows)} Q&A pairs into the in-memory vector index")
+    
+    async def _ensure_fresh(self):
+        if self._matrix is None or time.monotonic() - self._checked_at > KB_MEMORY_REFRESH_SECONDS:
+            await self.refresh()
+    
+    async def initialize(self):
+        await super().initialize()
+        await self.refresh(force=True)
+    
+    async def add_qa_pairs(self, qa_pairs: List[Dict]):
+        stats = await super().add_qa_pairs(qa_pairs)
+        await self.refresh()
+        return stats
+    
+    async def sync_qa_pairs(self, source: str, qa_pairs: List[Dict]) -> Dict[str, Any]:
+        stats = await super().sync_qa_pairs(source, qa_pairs)
+        if not stats["unchanged"]:
+            await self.refresh()
+        return stats
+    
+    async def load_snapshot(self, snapshot: Dict[str, Any], source_root: str) -> Dict[str, Any]:
+        """Load the snapshot into Postgres and straight into memory, without reading embeddings back."""
+        stats = await super().load_snapshot(snapshot, source_root)
+        if stats.get("skipped"):
+            await self.refresh(force=True)
+            return stats
+        async with self._refresh_lock:
+            async with self._acquire() as conn:
+                # The table was empty, so ids were assigned in snapshot order
+                loaded = await conn.fetch("SELECT id, answer_group, answer_is_canonical FROM qa_pairs ORDER BY id")
+                self._version = await self._table_version(conn)
+            rows = [
+                {"id": row["id"], "qa_id": qa["qa_id"], "question": qa["question"], "answer": qa["answer"],
+                 "source": os.path.join(source_root, qa["source"]), "answer_group": row["answer_group"]}
+                for row, qa in zip(loaded, snapshot["records"])
+            ]
+            self._load_matrices(
+                rows,
+                [row["answer_is_canonical"] for row in loaded],
+                snapshot["question_embeddings"],
+                snapshot["answer_embeddings"]
+            )
+            self._checked_at = time.monotonic()
+        return stats
+    
+    def _top_k(self, scores: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the k highest scores, best first."""
+        k = min(k, scores.shape[0])
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+    
+    def _score(self, query_embedding):
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        scores = self._matrix @ (query / norm if norm else query)
+        n = len(self._rows)
+        answer_scores = np.where(self._canonical, scores[n:], -np.inf)
+        return scores[:n], answer_scores
+    
+    def _result(self, i: int, similarity: float) -> Dict[str, Any]:
+        return {**self._rows[i], "similarity": float(similarity)}
+    
+    async def search_question(self, query: str, k: int = 5):
+        """Search by question similarity"""
+        query_embedding = await self.embed_query(query)
+        await self._ensure_fresh()
+        question_scores, _ = self._score(query_embedding)
+        return [self._result(i, question_scores[i]) for i in self._top_k(question_scores, k)]
+    
+    async def search_answer(self, query: str, k: int = 5):
+        """Search by answer similarity"""
+        query_embedding = await self.embed_query(query)
+        await self._ensure_fresh()
+        _, answer_scores = self._score(query_embedding)
+        k = min(k, int(self._canonical.sum()))
+        return [self._result(i, answer_scores[i]) for i in self._top_k(answer_scores, k)]
+    
+    async def search_dual_ranked(self, query: str, k: int = 5, ef_search: int = None, probes: int = None):
+        """Dual search with ranking from one matrix-vector product (search is exact, ANN settings are ignored).
+        
+        Like the pgvector search, results are k distinct answers.
+        """
+        query_embedding = await self.embed_query(query)
+        await self._ensure_fresh()
+        question_scores, answer_scores = self._score(query_embedding)
+        
+        # Keyed by answer group; question candidates arrive best first
+        fused: Dict[str, Dict[str, Any]] = {}
+        for i in self._top_k(question_scores, k * ANSWER_GROUP_CONFIG["question_candidate_factor"]):
+            group = self._rows[i]["answer_group"]
+            if group in fused:
+                continue
+            fused[group] = {
+                **self._result(i, question_scores[i]),
+                "final_score": float(question_scores[i]) * self.QUESTION_WEIGHT,
+                "match_type": "question"
+            }
+        for i in self._top_k(answer_scores, min(k, int(self._canonical.sum()))):
+            group = self._rows[i]["answer_group"]
+            weighted_score = float(answer_scores[i]) * self.ANSWER_WEIGHT
+            if group in fused:
+                fused[group]["final_score"] += weighted_score
+                fused[group]["match_type"] = "both"
+            else:
+                fused[group] = {
+                    **self._result(i, answer_scores[i]),
+                    "final_score": weighted_score,
+                    "match_type": "answer"
+                }
+        
+        return sorted(fused.values(), key=lambda x: x["final_score"], reverse=True)[:k]
 
 class CSVLoaderTool(BaseTool):
     """Load Q&A pairs from CSV"""
@@ -290,29 +1289,14 @@ class CSVLoaderTool(BaseTool):
                 return f"❌ CSV must have 'user' and 'standard_answer' columns. Found: {list(df.columns)}"
             
             # Build Q&A pairs
-            qa_pairs = []
-            for idx, row in df.iterrows():
-                question = str(row['user']).strip()
-                answer = str(row['standard_answer']).strip()
-                
-                if not question or not answer or question == 'nan' or answer == 'nan':
-                    continue
-                
-                qa_id = f"Qa_{idx+1:03d}"  # Generate QA ID if not present
-                if 'qa_id' in df.columns and not pd.isna(row['qa_id']):
-                    qa_id = str(row['qa_id']).strip()
-                
-                qa_pairs.append({
-                    "qa_id": qa_id,
-                    "question": question,
-                    "answer": answer,
-                    "source": csv_path
-                })
+            qa_pairs = build_qa_frame(df, csv_path).to_dict("records")
             
             # Add to database
-            await self.vector_store.add_qa_pairs(qa_pairs)
+            stats = await self.vector_store.add_qa_pairs(qa_pairs)
             
-            return f"✅ Loaded {len(qa_pairs)} Q&A pairs from {csv_filename}"
+            if not stats:
+                return f"✅ Loaded 0 Q&A pairs from {csv_filename}"
+            return f"✅ Loaded {stats['rows']} Q&A pairs from {csv_filename} ({stats['rows_per_sec']} rows/sec)"
             
         except Exception as e:
             return f"❌ Error loading CSV: {str(e)}"
@@ -323,9 +1307,10 @@ class SearchTool(BaseTool):
     name: str = "search_qa"
     description: str = "Search the Q&A knowledge base. Use this to find answers to user questions."
     vector_store: Any = None
+    context_builder: Any = None
     
     def __init__(self, vector_store):
-        super().__init__(vector_store=vector_store)
+        super().__init__(vector_store=vector_store, context_builder=ContextBuilder())
     
     def _run(self, user_question: str) -> str:
         return asyncio.run(self._arun(user_question))
@@ -339,13 +1324,18 @@ class SearchTool(BaseTool):
                     return self._format_single_result(result)
                 return "No Q&A pair found with that ID."
             
-            # Use dual search with ranking
-            results = await self.vector_store.search_dual_ranked(user_question, k=5)
+            # Verbatim (or near-verbatim) knowledge-base questions need no embedding
+            result = await self.vector_store.search_exact(user_question)
+            if result:
+                return self._format_dual_results([result], user_question)
+            
+            # Use dual search with ranking (fused with full-text search in hybrid mode)
+            results = await self.vector_store.search(user_question, k=5)
             
             if not results:
                 return "No matching Q&A pairs found."
             
-            return self._format_dual_results(results)
+            return self._format_dual_results(results, user_question)
             
         except Exception as e:
             return f"Search error: {str(e)}"
@@ -358,20 +1348,14 @@ Question: {result['question']}
 Answer: {result['answer']}
 Source: {result['source']}"""
     
-    def _format_dual_results(self, results: List[Dict]) -> str:
-        """Format dual search results - simplified for agent consumption"""
+    def _format_dual_results(self, results: List[Dict], query: str) -> str:
+        """Format dual search results - simplified for agent consumption, within the context token budget"""
         if not results:
             return "No relevant information found."
         
-        parts = ["Search Results:\n"]
-        
-        for i, result in enumerate(results, 1):
-            parts.append(f"""[Result {i}]
-Question: {result['question']}
-Answer: {result['answer']}
-""")
-        
-        return "\n".join(parts)
+        context, tokens = self.context_builder.build(query, results)
+        print(f"🧾 Search context: {context.count('[Result ')}/{len(results)} results, ~{tokens} tokens")
+        return context
 
 class RAGAgent:
     """Q&A RAG Agent"""
@@ -385,30 +1369,34 @@ class RAGAgent:
         if not self.connection_string:
             raise ValueError("PGVECTOR_CONNECTION not found")
         
-        self.vector_store = PGVectorStore(
+        store_class = NumpyVectorStore if RAG_VECTOR_BACKEND == "numpy" else PGVectorStore
+        self.vector_store = store_class(
             self.connection_string,
-            "models/text-embedding-004"
+            EMBEDDING_MODEL
         )
         
         self.llm = ChatGoogleGenerativeAI(
             model="gemini-2.0-flash",
             google_api_key=self.api_key,
-            temperature=0
+            temperature=0,
+            rate_limiter=get_llm_rate_limiter("gemini-2.0-flash")
         )
         
+        self.search_tool = None
         self.agent = None
+        self.direct_answer_stats = {"attempts": 0, "exact": 0, "ranked": 0}
     
     async def initialize(self):
         """Initialize RAG system"""
         await self.vector_store.initialize()
         
 
-        search_tool = SearchTool(self.vector_store)
+        self.search_tool = SearchTool(self.vector_store)
         
         # In RAGAgent.initialize
         self.agent = create_agent(
             model=self.llm,
-            tools=[search_tool],
+            tools=[self.search_tool],
             system_prompt="""You are a helpful and accurate Q&A assistant.
 
 Your job is to answer the user's question based *only* on the context provided by the `search_qa` tool.
@@ -427,31 +1415,94 @@ CRITICAL RULES:
 """
 )      
         return self.agent
+    
+    async def try_direct_answer(self, query: str):
+        """Return the stored answer when the knowledge base matches the query with high confidence.
+        
+        A normalized exact question match needs no embedding at all. Otherwise
+        the top dual-ranked result must match on both question and answer,
+        reach RAG_DIRECT_ANSWER_MIN_SCORE and lead the next distinct answer by
+        RAG_DIRECT_ANSWER_MIN_MARGIN. Returns the result dict or None.
+        """
+        if not RAG_DIRECT_ANSWER_CONFIG["enabled"]:
+            return None
+        self.direct_answer_stats["attempts"] += 1
         
+        result = await self.vector_store.search_exact(query)
+        if result:
+            self.direct_answer_stats["exact"] += 1
+            return result
+        
+        results = await self.vector_store.search_dual_ranked(query, k=2)
+        if not results:
+            return None
+        
+        top = results[0]
+        runner_up = results[1]["final_score"] if len(results) > 1 else 0.0
+        if (top["match_type"] == "both"
+                and top["final_score"] >= RAG_DIRECT_ANSWER_CONFIG["min_score"]
+                and top["final_score"] - runner_up >= RAG_DIRECT_ANSWER_CONFIG["min_margin"]):
+            self.direct_answer_stats["ranked"] += 1
+            return top
+        return None
+        
+
+
+async def sync_csv_file(vector_store, csv_filename: str):
+    """Incrementally sync one CSV file into the knowledge base"""
+    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    csv_path = os.path.join(project_root, csv_filename)
+    
+    df = pd.read_csv(csv_path)
+    if 'user' not in df.columns or 'standard_answer' not in df.columns:
+        print(f"❌ {csv_filename} must have 'user' and 'standard_answer' columns. Found: {list(df.columns)}")
+        return None
+    
+    return await vector_store.sync_qa_pairs(csv_path, build_qa_frame(df, csv_path).to_dict("records"))
 
 
-async def load_csv_files(rag):
-    """Load CSV files if not already loaded"""
-    csv_files = [
-        "qa_pairs.csv",
-        "qa_pairs_variations.csv",
-        "web_questions.csv",
-    ]
+async def load_csv_files(rag, mode: str = None):
+    """Load CSV files into the knowledge base.
+    
+    An empty table is first seeded from the embedding snapshot, if one was
+    built for the current model. In "incremental" mode (the default) every file is synced so only new or
+    changed rows are embedded; in "once" mode files are loaded only into an
+    empty table.
+    """
+    mode = mode or KB_LOAD_MODE
+    csv_files = KB_CSV_FILES
+    
+    # Get project root directory
+    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    
+    # Seed an empty table from the pre-computed snapshot instead of the embeddings API
+    if await rag.vector_store.get_qa_count() == 0:
+        snapshot = read_snapshot(rag.vector_store.embedding_model)
+        if snapshot:
+            await rag.vector_store.load_snapshot(snapshot, project_root)
+    
+    if mode == "incremental":
+        for csv_file in csv_files:
+            if os.path.exists(os.path.join(project_root, csv_file)):
+                await sync_csv_file(rag.vector_store, csv_file)
+        await rag.vector_store.ensure_vector_indexes()
+        return
     
     qa_count = await rag.vector_store.get_qa_count()
     
     if qa_count > 0:
+        await rag.vector_store.ensure_vector_indexes()
         return  # Silent if already loaded
     
     csv_loader = CSVLoaderTool(rag.vector_store)
     
-    # Get project root directory
-    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    
     for csv_file in csv_files:
         csv_path = os.path.join(project_root, csv_file)
         if os.path.exists(csv_path):
             await csv_loader._arun(csv_file)
+    
+    # IVFFlat indexes are deferred until the table has data to cluster
+    await rag.vector_store.ensure_vector_indexes()
 
 
 
@@ -465,7 +1516,8 @@ if __name__ == "__main__":
             model="gemini-2.0-flash",
             temperature=0,
             google_api_key=api_key,
-            max_output_tokens=2000
+            max_output_tokens=2000,
+            rate_limiter=get_llm_rate_limiter("gemini-2.0-flash")
         )
         
         # Initialize RAG agent
@@ -0,0 +1,38 @@
+"""
+Shared token-bucket rate limiters for upstream model APIs
+"""
+
+import os
+from typing import Dict
+from langchain_core.rate_limiters import InMemoryRateLimiter
+
+# --- Chat Model Rate Limits (per worker, per model) ---
+LLM_RATE_LIMIT_CONFIG = {
+    "requests_per_second": float(os.getenv("LLM_REQUESTS_PER_SECOND", "2")),
+    "burst": int(os.getenv("LLM_BURST", "4"))
+}
+
+# One limiter per upstream model so every caller in this worker shares its budget
+_RATE_LIMITERS: Dict[str, InMemoryRateLimiter] = {}
+
+
+def get_rate_limiter(name: str, requests_per_second: float, max_bucket_size: int = 1) -> InMemoryRateLimiter:
+    """Return the process-wide token bucket for name, creating it on first use."""
+    limiter = _RATE_LIMITERS.get(name)
+    if limiter is None:
+        limiter = InMemoryRateLimiter(
+            requests_per_second=requests_per_second,
+            check_every_n_seconds=0.05,
+            max_bucket_size=max_bucket_size
+        )
+        _RATE_LIMITERS[name] = limiter
+    return limiter
+
+
+def get_llm_rate_limiter(model: str) -> InMemoryRateLimiter:
+    """Token bucket shared by every chat model client for model in this worker."""
+    return get_rate_limiter(
+        f"llm:{model}",
+        LLM_RATE_LIMIT_CONFIG["requests_per_second"],
+        LLM_RATE_LIMIT_CONFIG["burst"]
+    )
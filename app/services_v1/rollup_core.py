@@ -0,0 +1,154 @@
+"""
+Trigger-maintained rollup tables for forex_trades analytics
+"""
+
+import os
+from typing import List, Dict
+
+# --- Rollup Settings ---
+ROLLUP_CONFIG = {
+    "enabled": os.getenv("SQL_ROLLUPS_ENABLED", "true").lower() == "true",
+    # Per-statement limit for install and backfill, in place of the pool's 3s command_timeout
+    # (workers also wait this long on the install lock while another one backfills)
+    "build_timeout_seconds": float(os.getenv("SQL_ROLLUP_BUILD_TIMEOUT_SECONDS", "1800"))
+}
+
+# Rollup table -> (bucket column, bucket expression over forex_trades)
+ROLLUPS: Dict[str, tuple] = {
+    "forex_trades_daily": ("Trade_Date", '"Trade_Date"'),
+    "forex_trades_monthly": ("Month", "DATE_TRUNC('month', \"Trade_Date\")::date")
+}
+ROLLUP_TABLES: List[str] = list(ROLLUPS)
+
+_MEASURES = [
+    ("trade_count", "BIGINT", 'COUNT(*)'),
+    ("winning_trades", "BIGINT", 'COUNT(*) FILTER (WHERE "Daily_PnL" > 0)'),
+    ("losing_trades", "BIGINT", 'COUNT(*) FILTER (WHERE "Daily_PnL" < 0)'),
+    ("total_pnl", "DECIMAL(18, 2)", 'SUM("Daily_PnL")'),
+    ("gross_profit", "DECIMAL(18, 2)", 'COALESCE(SUM("Daily_PnL") FILTER (WHERE "Daily_PnL" > 0), 0)'),
+    ("gross_loss", "DECIMAL(18, 2)", 'COALESCE(SUM("Daily_PnL") FILTER (WHERE "Daily_PnL" < 0), 0)'),
+    ("total_commission", "DECIMAL(18, 2)", 'COALESCE(SUM("Commission"), 0)'),
+    ("total_swap", "DECIMAL(18, 2)", 'COALESCE(SUM("Swap"), 0)'),
+    ("total_lots", "DECIMAL(18, 2)", 'SUM("Lot_Size")')
+]
+
+# Shown to the SQL agent alongside the table columns
+ROLLUP_SCHEMA_NOTE = """ROLLUPS (kept in sync with forex_trades on every write, one row per account, symbol and period):
+  - forex_trades_daily: one row per "Account_ID", "Trade_Date", "Symbol"
+  - forex_trades_monthly: one row per "Account_ID", "Month" (first day of the month), "Symbol"
+  Prefer them for totals, win rates, per-symbol and per-period breakdowns:
+  - total profit: SUM(total_pnl)
+  - win percentage: SUM(winning_trades) * 100.0 / SUM(trade_count)
+  - average profit per trade: SUM(total_pnl) / SUM(trade_count) (AVG(total_pnl) is per row, not per trade)
+  Use forex_trades itself for individual trades, prices, durations, status or notes."""
+
+
+def _create_table_sql(table: str) -> str:
+    bucket, _ = ROLLUPS[table]
+    measures = ",\n".join(f"            {name} {sql_type} NOT NULL DEFAULT 0" for name, sql_type, _ in _MEASURES)
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            "Account_ID" VARCHAR(50) NOT NULL,
+            "{bucket}" DATE NOT NULL,
+            "Symbol" VARCHAR(20) NOT NULL,
+{measures},
+            PRIMARY KEY ("Account_ID", "{bucket}", "Symbol")
+        );
+    """
+
+
+def _apply_sql(table: str, source: str, sign: int) -> str:
+    """Add (sign 1) or subtract (sign -1) the aggregates of source's rows into table."""
+    bucket, bucket_expr = ROLLUPS[table]
+    names = ", ".join(name for name, _, _ in _MEASURES)
+    values = ",\n".join(f"{sign} * {expression}" for _, _, expression in _MEASURES)
+    updates = ",\n".join(f"{name} = {table}.{name} + EXCLUDED.{name}" for name, _, _ in _MEASURES)
+    return f"""
+        INSERT INTO {table} ("Account_ID", "{bucket}", "Symbol", {names})
+        SELECT COALESCE("Account_ID", ''), {bucket_expr}, "Symbol",
+        {values}
+        FROM {source}
+        GROUP BY 1, 2, 3
+        ON CONFLICT ("Account_ID", "{bucket}", "Symbol") DO UPDATE SET
+        {updates};
+    """
+
+
+def _trigger_function_sql() -> str:
+    added = "".join(_apply_sql(table, "new_rows", 1) for table in ROLLUP_TABLES)
+    removed = "".join(_apply_sql(table, "old_rows", -1) for table in ROLLUP_TABLES)
+    emptied = "".join(f"DELETE FROM {table} WHERE trade_count = 0;\n" for table in ROLLUP_TABLES)
+    truncated = "".join(f"TRUNCATE {table};\n" for table in ROLLUP_TABLES)
+    return f"""
+        CREATE OR REPLACE FUNCTION forex_trades_rollup() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                {truncated}
+                RETURN NULL;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                {added}
+            END IF;
+            IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                {removed}
+                {emptied}
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """
+
+
+# Transition tables can't be shared between events, so each event gets its own statement trigger
+_TRIGGERS = {
+    "forex_trades_rollup_insert": "AFTER INSERT ON forex_trades REFERENCING NEW TABLE AS new_rows",
+    "forex_trades_rollup_update": (
+        "AFTER UPDATE ON forex_trades REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows"
+    ),
+    "forex_trades_rollup_delete": "AFTER DELETE ON forex_trades REFERENCING OLD TABLE AS old_rows",
+    "forex_trades_rollup_truncate": "AFTER TRUNCATE ON forex_trades"
+}
+
+
+async def rebuild_rollups(conn):
+    """Recompute every rollup from forex_trades (run inside a transaction that blocks writes)."""
+    timeout = ROLLUP_CONFIG["build_timeout_seconds"]
+    await conn.execute("LOCK TABLE forex_trades IN SHARE MODE", timeout=timeout)
+    for table in ROLLUP_TABLES:
+        await conn.execute(f"TRUNCATE {table}", timeout=timeout)
+        await conn.execute(_apply_sql(table, "forex_trades", 1), timeout=timeout)
+
+
+async def ensure_rollups(pool) -> bool:
+    """Create the rollup tables and their maintenance triggers, backfilling on first install.
+
+    Workers starting together serialize on an advisory lock, so only one of
+    them installs the triggers and backfills. Returns True if rollups are on.
+    """
+    if not ROLLUP_CONFIG["enabled"]:
+        return False
+
+    timeout = ROLLUP_CONFIG["build_timeout_seconds"]
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('forex_trades_rollups'))", timeout=timeout)
+            for table in ROLLUP_TABLES:
+                await conn.execute(_create_table_sql(table), timeout=timeout)
+            await conn.execute(_trigger_function_sql(), timeout=timeout)
+
+            existing = {
+                row["tgname"] for row in await conn.fetch(
+                    "SELECT tgname FROM pg_trigger WHERE tgrelid = 'forex_trades'::regclass", timeout=timeout
+                )
+            }
+            missing = [name for name in _TRIGGERS if name not in existing]
+            for name in missing:
+                await conn.execute(
+                    f"CREATE TRIGGER {name} {_TRIGGERS[name]} FOR EACH STATEMENT EXECUTE FUNCTION forex_trades_rollup()",
+                    timeout=timeout
+                )
+            # Writes made while any trigger was missing never reached the rollups
+            if missing:
+                await rebuild_rollups(conn)
+                print(f"📊 Built forex_trades rollups: {', '.join(ROLLUP_TABLES)}")
+    return True
@@ -0,0 +1,157 @@
+"""
+Deterministic query router in front of the Deep Agent orchestrator
+"""
+
+import os
+import re
+import numpy as np
+from typing import List, Dict, Any, Optional
+
+from app.services_v1.constants import (
+    SQL_ROUTING_KEYWORDS,
+    SQL_ROUTING_PLURALS,
+    RAG_ROUTING_KEYWORDS,
+    KNOWLEDGE_QUESTION_KEYWORDS,
+    EXPLANATION_KEYWORDS,
+    FOLLOW_UP_KEYWORDS,
+    PERSONAL_PRONOUNS,
+    GREETINGS,
+    SQL_ROUTING_EXAMPLES
+)
+
+# --- Router Settings ---
+QUERY_ROUTER_CONFIG = {
+    "enabled": os.getenv("QUERY_ROUTER_ENABLED", "true").lower() == "true",
+    # Nearest-centroid fallback for queries the keyword rules can't place (costs one embedding call)
+    "classifier": os.getenv("QUERY_ROUTER_CLASSIFIER", "false").lower() == "true",
+    "classifier_margin": float(os.getenv("QUERY_ROUTER_CLASSIFIER_MARGIN", "0.05"))
+}
+
+# Routes
+GREETING = "greeting"
+RAG = "rag"
+SQL = "sql"
+MIXED = "mixed"      # trading data plus an explanation: needs the orchestrator to plan
+UNKNOWN = "unknown"  # no signal either way
+
+
+def _phrase_pattern(phrases: List[str]) -> re.Pattern:
+    return re.compile(r"\b(" + "|".join(re.escape(phrase) for phrase in phrases) + r")\b", re.IGNORECASE)
+
+
+_PERSONAL_PATTERN = _phrase_pattern(PERSONAL_PRONOUNS)
+_SQL_PATTERN = _phrase_pattern(SQL_ROUTING_KEYWORDS + SQL_ROUTING_PLURALS)
+_RAG_PATTERN = _phrase_pattern(RAG_ROUTING_KEYWORDS + KNOWLEDGE_QUESTION_KEYWORDS)
+# "What is my ..." asks for the user's own figures, not a definition
+_OWN_DATA_QUESTION = re.compile(r"\bwhat(?:'s|\s+is|\s+are|\s+was|\s+were)\s+(?:my|mine)\b", re.IGNORECASE)
+_EXPLANATION_PATTERN = _phrase_pattern(EXPLANATION_KEYWORDS)
+_FOLLOW_UP_PATTERN = _phrase_pattern(FOLLOW_UP_KEYWORDS)
+_CONTINUATION = re.compile(r"^\s*(and|or|also|but|then)\b", re.IGNORECASE)
+_GREETINGS = set(GREETINGS)
+_NON_WORD = re.compile(r"[^\w']+")
+
+
+def is_personal_query(query: str) -> bool:
+    """True if the query asks about the user's own trading data (SQL Agent territory)."""
+    return bool(_PERSONAL_PATTERN.search(query)) and bool(_SQL_PATTERN.search(query))
+
+
+def is_knowledge_question(query: str) -> bool:
+    """True if the query is phrased as a knowledge-base question ("how do I ...", "who should I email?")."""
+    return bool(_RAG_PATTERN.search(_OWN_DATA_QUESTION.sub(" ", query)))
+
+
+def is_follow_up(query: str) -> bool:
+    """True if the query refers back to earlier turns ("what about GBPUSD?", "and last month?")."""
+    return bool(_FOLLOW_UP_PATTERN.search(query) or _CONTINUATION.match(query))
+
+
+def is_greeting(query: str) -> bool:
+    """True if the whole message is a greeting such as "hi" or "good morning!"."""
+    return _NON_WORD.sub(" ", query.lower()).strip() in _GREETINGS
+
+
+class QueryRouter:
+    """Route clear-cut queries without the orchestrator LLM.
+
+    Keyword rules come from the routing keywords in constants.py: greetings
+    are answered directly, personal trading-data questions go to the SQL
+    Agent and knowledge questions go to the RAG Agent. Queries with both
+    trading-data and knowledge or explanation signals ("how do I calculate
+    my profit?") are MIXED and queries with no signal are UNKNOWN; both
+    fall back to the Deep Agent. When the classifier is enabled, UNKNOWN
+    queries are placed by cosine similarity to a knowledge-base centroid and a
+    trading-data centroid, if one is closer by at least classifier_margin.
+    """
+
+    def __init__(self, use_classifier: bool = None, margin: float = None):
+        self.use_classifier = QUERY_ROUTER_CONFIG["classifier"] if use_classifier is None else use_classifier
+        self.margin = margin if margin is not None else QUERY_ROUTER_CONFIG["classifier_margin"]
+        self._centroids: Optional[Dict[str, np.ndarray]] = None
+        self._stats = {GREETING: 0, RAG: 0, SQL: 0, MIXED: 0, UNKNOWN: 0, "classified": 0}
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def initialize(self, vector_store):
+        """Build the classifier centroids: mean KB question embedding and mean SQL example embedding."""
+        if not self.use_classifier:
+            return
+
+        async with vector_store._acquire() as conn:
+            rag_centroid = await conn.fetchval(
+                "SELECT AVG(question_embedding) FROM qa_pairs WHERE question_embedding IS NOT NULL"
+            )
+        if rag_centroid is None:
+            print("⚠️ Router classifier disabled: knowledge base is empty")
+            return
+
+        sql_embeddings = await vector_store.embeddings.aembed_documents(SQL_ROUTING_EXAMPLES)
+        self._centroids = {
+            RAG: self._unit(rag_centroid),
+            SQL: self._unit(np.mean(np.asarray(sql_embeddings, dtype=np.float32), axis=0))
+        }
+        print("🧭 Router classifier ready")
+
+    @property
+    def classifier_ready(self) -> bool:
+        return self._centroids is not None
+
+    def classify(self, query: str) -> str:
+        """Route a query by keyword rules alone (no model calls)."""
+        if is_greeting(query):
+            route = GREETING
+        else:
+            sql = is_personal_query(query)
+            rag = is_knowledge_question(query)
+            if sql and (rag or _EXPLANATION_PATTERN.search(query)):
+                route = MIXED
+            elif sql:
+                route = SQL
+            elif rag:
+                route = RAG
+            else:
+                route = UNKNOWN
+        self._stats[route] += 1
+        return route
+
+    def classify_embedding(self, query_embedding) -> str:
+        """Place an UNKNOWN query by its nearest centroid, or keep it UNKNOWN if too close to call."""
+        if not self.classifier_ready:
+            return UNKNOWN
+
+        query = self._unit(query_embedding)
+        rag_score = float(query @ self._centroids[RAG])
+        sql_score = float(query @ self._centroids[SQL])
+        if abs(rag_score - sql_score) < self.margin:
+            return UNKNOWN
+
+        self._stats["classified"] += 1
+        return RAG if rag_score > sql_score else SQL
+
+    def stats(self) -> Dict[str, Any]:
+        """Rule-based route counts and classifier decisions."""
+        return {**self._stats, "classifier_ready": self.classifier_ready}
@@ -0,0 +1,181 @@
+"""
+Per-session conversation memory for the Deep Agent
+"""
+
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Any, List
+
+from langchain.agents.middleware import SummarizationMiddleware
+from langchain_core.messages import HumanMessage, AIMessage
+from langgraph.checkpoint.memory import InMemorySaver
+
+# --- Session Settings ---
+SESSION_CONFIG = {
+    "enabled": os.getenv("SESSIONS_ENABLED", "true").lower() == "true",
+    "backend": os.getenv("SESSION_STORE", "memory"),  # memory | postgres
+    "postgres_dsn": os.getenv("SESSION_POSTGRES_DSN") or os.getenv("PGVECTOR_CONNECTION"),
+    "max_sessions": int(os.getenv("SESSION_MAX_SESSIONS", "1000")),
+    "ttl_seconds": float(os.getenv("SESSION_TTL_SECONDS", "1800")),
+    # postgres backend: how often each worker deletes expired sessions from the shared store
+    "sweep_interval_seconds": float(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", "60")),
+    # Server workers sharing the sessions (gunicorn's WEB_CONCURRENCY); more than one needs postgres
+    "workers": int(os.getenv("WEB_CONCURRENCY", "1")),
+    "max_history_tokens": int(os.getenv("SESSION_MAX_HISTORY_TOKENS", "4000")),
+    "messages_to_keep": int(os.getenv("SESSION_MESSAGES_TO_KEEP", "6"))
+}
+
+
+class SessionSummarizationMiddleware(SummarizationMiddleware):
+    """Summarizes session history past the session token budget.
+
+    A subclass so it can run alongside the Deep Agent's own (much larger)
+    SummarizationMiddleware, since agents reject duplicate middleware.
+    """
+
+
+class SessionStore:
+    """LangGraph checkpointer holding one conversation thread per session_id.
+
+    With the memory backend (single worker only) sessions are tracked in
+    LRU order; a session idle for ttl_seconds, or the least recently used
+    one once max_sessions is exceeded, has its thread deleted. With the
+    postgres backend every worker shares the threads, so last use is
+    recorded in the shared session_activity table and sessions are only
+    evicted once idle for ttl_seconds, by whichever worker sweeps first.
+    """
+
+    def __init__(self):
+        self.backend = SESSION_CONFIG["backend"]
+        self.max_sessions = SESSION_CONFIG["max_sessions"]
+        self.ttl_seconds = SESSION_CONFIG["ttl_seconds"]
+        self.checkpointer = None
+        self._postgres_context = None
+        self._sessions: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = asyncio.Lock()
+        self._last_sweep = 0.0
+        self._stats = {"recorded_turns": 0, "evicted_lru": 0, "evicted_ttl": 0}
+
+    async def initialize(self):
+        """Open the checkpointer for the configured backend."""
+        if self.backend != "postgres" and SESSION_CONFIG["workers"] > 1:
+            raise RuntimeError(
+                f"SESSION_STORE={self.backend} keeps sessions inside one process; "
+                f"{SESSION_CONFIG['workers']} workers need SESSION_STORE=postgres"
+            )
+        if self.backend == "postgres":
+            try:
+                from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+            except ImportError:
+                raise RuntimeError(
+                    "SESSION_STORE=postgres needs langgraph-checkpoint-postgres "
+                    "(pip install langgraph-checkpoint-postgres 'psycopg[binary,pool]')"
+                )
+            self._postgres_context = AsyncPostgresSaver.from_conn_string(SESSION_CONFIG["postgres_dsn"])
+            self.checkpointer = await self._postgres_context.__aenter__()
+            await self.checkpointer.setup()
+            await self._execute(
+                """
+                CREATE TABLE IF NOT EXISTS session_activity (
+                    session_id TEXT PRIMARY KEY,
+                    last_seen TIMESTAMPTZ NOT NULL DEFAULT now()
+                )
+                """
+            )
+        else:
+            self.checkpointer = InMemorySaver()
+        print(f"💬 Session store ready ({self.backend})")
+
+    async def close(self):
+        if self._postgres_context is not None:
+            await self._postgres_context.__aexit__(None, None, None)
+            self._postgres_context = None
+
+    def summarization_middleware(self, model) -> SessionSummarizationMiddleware:
+        """Middleware capping history at max_history_tokens by summarizing older turns."""
+        return SessionSummarizationMiddleware(
+            model=model,
+            max_tokens_before_summary=SESSION_CONFIG["max_history_tokens"],
+            messages_to_keep=SESSION_CONFIG["messages_to_keep"]
+        )
+
+    @staticmethod
+    def config(session_id: str) -> Dict[str, Any]:
+        """Run config selecting the session's thread."""
+        return {"configurable": {"thread_id": session_id}}
+
+    async def _execute(self, sql: str, *params) -> List[Dict[str, Any]]:
+        """Run sql on the postgres checkpointer's connection."""
+        async with self.checkpointer.lock, self.checkpointer.conn.cursor() as cur:
+            await cur.execute(sql, params)
+            return await cur.fetchall() if cur.description else []
+
+    async def touch(self, session_id: str):
+        """Mark a session as used and evict expired or excess sessions."""
+        if self.backend == "postgres":
+            await self._touch_shared(session_id)
+            return
+
+        async with self._lock:
+            now = time.monotonic()
+            self._sessions[session_id] = now
+            self._sessions.move_to_end(session_id)
+
+            # Oldest first, so expired sessions are all at the front
+            while now - next(iter(self._sessions.values())) > self.ttl_seconds:
+                sid, _ = self._sessions.popitem(last=False)
+                await self.checkpointer.adelete_thread(sid)
+                self._stats["evicted_ttl"] += 1
+
+            while len(self._sessions) > self.max_sessions:
+                sid, _ = self._sessions.popitem(last=False)
+                await self.checkpointer.adelete_thread(sid)
+                self._stats["evicted_lru"] += 1
+
+    async def _touch_shared(self, session_id: str):
+        await self._execute(
+            """
+            INSERT INTO session_activity (session_id) VALUES (%s)
+            ON CONFLICT (session_id) DO UPDATE SET last_seen = now()
+            """,
+            session_id
+        )
+
+        now = time.monotonic()
+        if now - self._last_sweep < SESSION_CONFIG["sweep_interval_seconds"]:
+            return
+        self._last_sweep = now
+        # DELETE ... RETURNING hands each expired session to exactly one worker
+        expired = await self._execute(
+            "DELETE FROM session_activity WHERE last_seen < now() - make_interval(secs => %s) RETURNING session_id",
+            self.ttl_seconds
+        )
+        for row in expired:
+            await self.checkpointer.adelete_thread(row["session_id"])
+            self._stats["evicted_ttl"] += 1
+
+    async def has_history(self, session_id: str) -> bool:
+        return await self.checkpointer.aget_tuple(self.config(session_id)) is not None
+
+    async def record_turn(self, agent, session_id: str, query: str, answer: str):
+        """Append a turn answered outside the session agent to its history."""
+        await agent.aupdate_state(
+            self.config(session_id),
+            {"messages": [HumanMessage(content=query), AIMessage(content=answer)]},
+            as_node="model"
+        )
+        self._stats["recorded_turns"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Session counts and evictions."""
+        return {
+            **self._stats,
+            "backend": self.backend,
+            # postgres: sessions are shared by every worker, and only evicted by TTL
+            "active_sessions": len(self._sessions) if self.backend != "postgres" else None,
+            "max_sessions": self.max_sessions if self.backend != "postgres" else None,
+            "ttl_seconds": self.ttl_seconds,
+            "max_history_tokens": SESSION_CONFIG["max_history_tokens"]
+        }
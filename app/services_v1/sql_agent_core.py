@@ -2,6 +2,7 @@ import os
 import asyncio
 import time
 import re
+import json
 import asyncpg
 from functools import lru_cache
 from dotenv import load_dotenv
@@ -17,12 +18,19 @@ import plotly.graph_objects as go
 import plotly.express as px
 from datetime import datetime
 
+from app.services_v1.rate_limit import get_llm_rate_limiter
+from app.services_v1.cache_core import QueryResultCache
+from app.services_v1.rollup_core import ROLLUP_TABLES, ROLLUP_SCHEMA_NOTE, ensure_rollups
+from app.services_v1.account_core import AccountScopeError, current_account, scope_sql, ensure_account_indexes
+
 console = Console()
 load_dotenv()
 
 # --- Global State ---
 DB_POOL = None
 SCHEMA_CACHE = None
+ROLLUPS_READY = False
+RESULT_CACHE = QueryResultCache()
 
 DB_CONFIG = {
     "user": "avivekanandan",
@@ -32,6 +40,15 @@ DB_CONFIG = {
     "table": "forex_trades"
 }
 
+# Limits for running LLM-generated SQL
+SQL_GUARD_CONFIG = {
+    "max_cost": float(os.getenv("SQL_MAX_PLAN_COST", "500000")),          # planner cost units
+    "max_plan_rows": float(os.getenv("SQL_MAX_PLAN_ROWS", "5000000")),    # estimated rows in any plan node
+    "max_result_rows": int(os.getenv("SQL_MAX_RESULT_ROWS", "1000")),
+    # Below the pool's 3s command_timeout, so Postgres cancels the query before the client gives up on it
+    "statement_timeout_ms": int(os.getenv("SQL_STATEMENT_TIMEOUT_MS", "2500"))
+}
+
 # Pre-compiled regex patterns for speed
 DANGEROUS_PATTERNS = [
     re.compile(r'\bDROP\b', re.IGNORECASE),
@@ -44,11 +61,15 @@ DANGEROUS_PATTERNS = [
     re.compile(r'\bGRANT\b', re.IGNORECASE),
     re.compile(r'\bREVOKE\b', re.IGNORECASE),
     re.compile(r'\bEXECUTE\b', re.IGNORECASE),
-    re.compile(r'\b--\b'),
+    re.compile(r'--'),
     re.compile(r'/\*'),
     re.compile(r'\bEXEC\b', re.IGNORECASE)
 ]
 
+class QueryRejected(Exception):
+    """Raised when a query's plan is too expensive to run."""
+
+
 class SQLValidator:
     """Optimized validator with pre-compiled patterns."""
     
@@ -78,7 +99,8 @@ class SQLValidator:
         
         # Simplified checks - only critical mismatches
         if ('profit' in user_lower or 'loss' in user_lower or 'pnl' in user_lower):
-            if not any(col in sql_upper for col in ['PNL', 'PROFIT', 'LOSS', 'DAILY']):
+            # Rollup win/loss counts answer "profit percentage" without a PnL column
+            if not any(col in sql_upper for col in ['PNL', 'PROFIT', 'LOSS', 'DAILY', 'WINNING_TRADES', 'LOSING_TRADES']):
                 return False, "INTENT_VIOLATION: Missing profit/loss column."
         
         if ('percentage' in user_lower or '%' in user_lower):
@@ -90,8 +112,9 @@ class SQLValidator:
                 return False, "INTENT_VIOLATION: Total query needs SUM()."
         
         if ('average' in user_lower or 'avg' in user_lower):
-            if 'AVG(' not in sql_upper:
-                return False, "INTENT_VIOLATION: Average query needs AVG()."
+            # Rollups give per-trade averages as SUM(total_pnl) / SUM(trade_count)
+            if 'AVG(' not in sql_upper and not ('TRADE_COUNT' in sql_upper and '/' in sql):
+                return False, "INTENT_VIOLATION: Average query needs AVG() or SUM(...) / SUM(trade_count)."
         
         if any(kw in user_lower for kw in ['most', 'highest', 'best', 'top']):
             if 'ORDER BY' not in sql_upper or 'DESC' not in sql_upper:
@@ -112,6 +135,30 @@ class SQLValidator:
         
         return True, "OK"
     
+    @staticmethod
+    def cost_check(explain_json: str) -> Tuple[bool, str]:
+        """Phase 4: Reject plans over the configured cost or row estimates (run on EXPLAIN output)."""
+        plan = json.loads(explain_json)[0]["Plan"]
+        
+        max_rows, widest = 0.0, plan
+        nodes = [plan]
+        while nodes:
+            node = nodes.pop()
+            if node.get("Plan Rows", 0) > max_rows:
+                max_rows, widest = node["Plan Rows"], node
+            nodes.extend(node.get("Plans", []))
+        
+        if plan["Total Cost"] > SQL_GUARD_CONFIG["max_cost"]:
+            return False, (
+                f"COST_LIMIT: Estimated cost {plan['Total Cost']:.0f} exceeds {SQL_GUARD_CONFIG['max_cost']:.0f}."
+            )
+        if max_rows > SQL_GUARD_CONFIG["max_plan_rows"]:
+            return False, (
+                f"ROW_LIMIT: A {widest['Node Type']} step is estimated at {max_rows:.0f} rows "
+                f"(limit {SQL_GUARD_CONFIG['max_plan_rows']:.0f})."
+            )
+        return True, "OK"
+    
     @staticmethod
     def validate_complete(sql: str, user_query: str) -> Dict:
         """Fast 3-phase validation."""
@@ -134,11 +181,23 @@ class SQLValidator:
 
 
 
+@lru_cache(maxsize=1)
+def _visualization_llm() -> ChatGoogleGenerativeAI:
+    """Small YES/NO classifier model, created once and sharing the Gemini rate limit."""
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.0-flash",
+        temperature=0,
+        google_api_key=os.getenv("GOOGLE_API_KEY"),
+        max_output_tokens=10,
+        rate_limiter=get_llm_rate_limiter("gemini-2.0-flash")
+    )
+
+
 class ChartGenerator:
     """Intelligent chart generation based on query type."""
     
     @staticmethod
-    def should_visualize(user_query: str, results: List) -> bool:
+    async def should_visualize(user_query: str, results: List) -> bool:
         """Dual-layer visualization detection: Keywords + LLM."""
         if not results or len(results) == 0:
             return False
@@ -170,20 +229,10 @@ class ChartGenerator:
         
         # Layer 2: LLM-based intelligent check (for edge cases)
         try:
-            from langchain_google_genai import ChatGoogleGenerativeAI
-            import os
-            
-            llm = ChatGoogleGenerativeAI(
-                model="gemini-2.0-flash",
-                temperature=0,
-                google_api_key=os.getenv("GOOGLE_API_KEY"),
-                max_output_tokens=10
-            )
-            
             columns = list(results[0].keys())
             prompt = f"Query: '{user_query}' | {len(results)} rows, columns: {columns}. Would a chart help? Answer YES/NO:"
             
-            response = llm.invoke(prompt)
+            response = await _visualization_llm().ainvoke(prompt)
             return 'YES' in response.content.upper()
             
         except:
@@ -358,7 +407,7 @@ class ChartGenerator:
 # --- Database Pool Management ---
 async def init_db_pool():
     """Initialize connection pool with aggressive settings."""
-    global DB_POOL
+    global DB_POOL, ROLLUPS_READY
     if DB_POOL is None:
         DB_POOL = await asyncpg.create_pool(
             user=DB_CONFIG["user"],
@@ -370,6 +419,20 @@ async def init_db_pool():
             command_timeout=3,
             max_inactive_connection_lifetime=300
         )
+        try:
+            ROLLUPS_READY = await ensure_rollups(DB_POOL)
+        except Exception as e:
+            print(f"⚠️ forex_trades rollups disabled: {e}")
+        try:
+            await ensure_account_indexes(DB_POOL)
+        except Exception as e:
+            print(f"⚠️ Account indexes not built: {e}")
+        try:
+            tables = [DB_CONFIG["table"]] + (ROLLUP_TABLES if ROLLUPS_READY else [])
+            await RESULT_CACHE.initialize(DB_POOL, tables)
+        except Exception as e:
+            RESULT_CACHE.enabled = False
+            print(f"⚠️ SQL result cache disabled: {e}")
 
 async def cleanup_db_pool():
     """Close pool on exit."""
@@ -390,25 +453,74 @@ async def _fetch_schema() -> str:
     if SCHEMA_CACHE:
         return SCHEMA_CACHE
     
+    tables = [DB_CONFIG["table"]] + (ROLLUP_TABLES if ROLLUPS_READY else [])
     async with DB_POOL.acquire() as conn:
         results = await conn.fetch("""
-            SELECT column_name, data_type 
+            SELECT table_name, column_name, data_type 
             FROM information_schema.columns 
-            WHERE table_name = 'forex_trades'
-            ORDER BY ordinal_position
-        """)
+            WHERE table_name::text = ANY($1::text[])
+            ORDER BY array_position($1::text[], table_name::text), ordinal_position
+        """, tables)
     
     if not results:
         return "ERROR: Table 'forex_trades' not found"
     
     # Compact schema format
-    schema = "TABLE: forex_trades\n\nCOLUMNS:\n"
-    schema += "\n".join(f"  - {r['column_name']} ({r['data_type']})" for r in results)
+    blocks = []
+    for table in tables:
+        columns = [r for r in results if r['table_name'] == table]
+        if columns:
+            blocks.append(f"TABLE: {table}\n\nCOLUMNS:\n" + "\n".join(
+                f"  - {r['column_name']} ({r['data_type']})" for r in columns
+            ))
+    schema = "\n\n".join(blocks)
+    if ROLLUPS_READY:
+        schema += f"\n\n{ROLLUP_SCHEMA_NOTE}"
     schema += "\n\nNOTE: Use double quotes for mixed-case columns!"
     
     SCHEMA_CACHE = schema
     return schema
 
+# --- Query Execution ---
+async def run_select(sql_query: str, *args) -> List:
+    """Run a validated SELECT on the shared pool, serving unchanged tables from the result cache.
+    
+    Within an account scope the query only sees that account's trades: the
+    account is bound as the parameter after args. At most max_result_rows
+    rows are returned, and QueryRejected is raised when EXPLAIN estimates
+    the query above the SQL_GUARD_CONFIG limits.
+    """
+    if DB_POOL is None:
+        await init_db_pool()
+    
+    account = current_account()
+    if account is not None:
+        sql_query = scope_sql(sql_query, len(args) + 1)
+        args = args + (account,)
+    
+    # Capped result size, checked plan and a server-side time limit, all in a read-only transaction
+    # The wrapper goes on its own lines so nothing at the end of the query can swallow it
+    bounded = f"SELECT * FROM (\n{sql_query.strip().rstrip(';')}\n) AS bounded LIMIT {SQL_GUARD_CONFIG['max_result_rows']}"
+    
+    async def fetch():
+        async with DB_POOL.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                await conn.execute(f"SET LOCAL statement_timeout = {SQL_GUARD_CONFIG['statement_timeout_ms']}")
+                is_valid, msg = SQLValidator.cost_check(await conn.fetchval(f"EXPLAIN (FORMAT JSON) {bounded}", *args))
+                if not is_valid:
+                    raise QueryRejected(msg)
+                return await conn.fetch(bounded, *args)
+    
+    return await RESULT_CACHE.fetch(sql_query, args, fetch)
+
+def format_rows(results: List, limit: int = 15) -> str:
+    """Compact pipe-separated table of the first limit rows."""
+    columns = list(results[0].keys())
+    header = " | ".join(columns)
+    rows = "\n".join(" | ".join(str(row[col]) for col in columns) for row in results[:limit])
+    more = f"\n... +{len(results) - limit} more" if len(results) > limit else ""
+    return f"{header}\n{'-' * len(header)}\n{rows}{more}"
+
 # --- Optimized Tools ---
 @tool("validate_and_execute")
 async def validate_and_execute(sql_query: str, user_query: str, attempt: int = 1) -> str:
@@ -431,8 +543,7 @@ ACTION: Fix the issue and retry."""
     
     # Execute query
     try:
-        async with DB_POOL.acquire() as conn:
-            results = await conn.fetch(sql_query)
+        results = await run_select(sql_query)
         
         if not results:
             return "VALIDATION PASSED\nEXECUTION SUCCESSFUL\nNo results returned."
@@ -441,22 +552,17 @@ ACTION: Fix the issue and retry."""
         results_list = [dict(row) for row in results]
         
         # Minimal formatting for speed
-        columns = list(results[0].keys())
-        header = " | ".join(columns)
-        rows = "\n".join(" | ".join(str(row[col]) for col in columns) for row in results[:15])
-        more = f"\n... +{len(results) - 15} more" if len(results) > 15 else ""
-        
         output = f"""VALIDATION PASSED
 EXECUTION SUCCESSFUL
 
-{header}
-{"-" * len(header)}
-{rows}{more}
+{format_rows(results)}
 
 Rows: {len(results)}"""
+        if len(results) >= SQL_GUARD_CONFIG["max_result_rows"]:
+            output += f" (capped at {SQL_GUARD_CONFIG['max_result_rows']}; aggregate or filter for complete figures)"
 
         # Check if visualization is needed
-        if ChartGenerator.should_visualize(user_query, results_list):
+        if await ChartGenerator.should_visualize(user_query, results_list):
             output += "\n\n[VISUALIZATION_RECOMMENDED]"
             # Store results globally for visualization
             global LAST_QUERY_RESULTS, LAST_USER_QUERY
@@ -465,6 +571,30 @@ Rows: {len(results)}"""
         
         return output
     
+    except QueryRejected as e:
+        return f"""QUERY TOO EXPENSIVE (Attempt {attempt}/3)
+
+{str(e)}
+
+SOLUTION:
+1. Use forex_trades_daily / forex_trades_monthly for totals and breakdowns
+2. Filter on "Trade_Date" or "Symbol" and aggregate instead of listing rows
+3. Join only on matching keys (no cross joins)"""
+    
+    except asyncpg.exceptions.QueryCanceledError:
+        return f"""EXECUTION ERROR (Attempt {attempt}/3)
+
+Query exceeded the {SQL_GUARD_CONFIG['statement_timeout_ms']} ms time limit.
+
+SOLUTION: Use the rollup tables or narrow the date range, then retry."""
+    
+    except AccountScopeError as e:
+        return f"""EXECUTION ERROR (Attempt {attempt}/3)
+
+{str(e)}
+
+SOLUTION: Query forex_trades and its rollups directly in FROM/JOIN clauses, or tell the user if an account is required."""
+    
     except asyncpg.exceptions.UndefinedColumnError as e:
         col_name = str(e).split('"')[1] if '"' in str(e) else "unknown"
         return f"""EXECUTION ERROR (Attempt {attempt}/3)
@@ -504,7 +634,8 @@ def setup_llm():
         google_api_key=api_key,
         max_output_tokens=800,
         max_retries=1,
-        timeout=5
+        timeout=5,
+        rate_limiter=get_llm_rate_limiter("gemini-2.0-flash")
     )
 
 llm = setup_llm()
@@ -521,15 +652,16 @@ WORKFLOW:
 
 2. GENERATE SQL (One shot - be precise):
    
-   Quick Patterns:
-   - "profit percentage" → (COUNT(CASE WHEN "Daily_PnL" > 0 THEN 1 END) * 100.0 / COUNT(*))
-   - "total profit" → SUM("Daily_PnL")
-   - "most profitable" → SELECT "Symbol", "Daily_PnL" FROM forex_trades ORDER BY "Daily_PnL" DESC LIMIT 10
-   - "top profitable pairs" → SELECT "Symbol", SUM("Daily_PnL") as total_profit FROM forex_trades GROUP BY "Symbol" ORDER BY total_profit DESC LIMIT 10
-   - "average" → AVG("Daily_PnL")
-   - "profit over time/period" → SELECT "Trade_Date", "Daily_PnL" WHERE date_range ORDER BY "Trade_Date"
-   - "monthly breakdown" → SELECT DATE_TRUNC('month', "Trade_Date") as month, SUM("Daily_PnL") GROUP BY month ORDER BY month
-   - "performance over time" → SELECT "Trade_Date", "Daily_PnL" FROM forex_trades ORDER BY "Trade_Date"
+   Quick Patterns (use the rollup tables when get_schema lists them; they are much smaller):
+   - "profit percentage" → SELECT SUM(winning_trades) * 100.0 / SUM(trade_count) FROM forex_trades_monthly
+     (without rollups: (COUNT(CASE WHEN "Daily_PnL" > 0 THEN 1 END) * 100.0 / COUNT(*)) FROM forex_trades)
+   - "total profit" → SELECT SUM(total_pnl) AS total_profit FROM forex_trades_monthly
+   - "most profitable" (single trades) → SELECT "Symbol", "Daily_PnL" FROM forex_trades ORDER BY "Daily_PnL" DESC LIMIT 10
+   - "top profitable pairs" → SELECT "Symbol", SUM(total_pnl) as total_profit FROM forex_trades_monthly GROUP BY "Symbol" ORDER BY total_profit DESC LIMIT 10
+   - "average" (per trade) → SELECT SUM(total_pnl) / SUM(trade_count) AS avg_profit FROM forex_trades_monthly
+   - "profit over time/period" → SELECT "Trade_Date", SUM(total_pnl) AS daily_pnl FROM forex_trades_daily WHERE date_range GROUP BY "Trade_Date" ORDER BY "Trade_Date"
+   - "monthly breakdown" → SELECT "Month", SUM(total_pnl) AS monthly_pnl FROM forex_trades_monthly GROUP BY "Month" ORDER BY "Month"
+   - "performance over time" → SELECT "Trade_Date", SUM(total_pnl) AS daily_pnl FROM forex_trades_daily GROUP BY "Trade_Date" ORDER BY "Trade_Date"
    
    CRITICAL:
    - Use exact column names with double quotes: "Daily_PnL"
@@ -0,0 +1,314 @@
+"""
+Validated NL-to-SQL plan cache for the SQL agent
+"""
+
+import os
+import re
+import time
+import asyncio
+import numpy as np
+from collections import OrderedDict
+from datetime import date
+from decimal import Decimal
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+
+from app.services_v1.cache_core import normalize_text, text_key
+from app.services_v1.sql_agent_core import run_select, format_rows
+from app.services_v1.account_core import AccountScopeError
+
+# --- SQL Plan Cache Settings ---
+SQL_PLAN_CACHE_CONFIG = {
+    "enabled": os.getenv("SQL_PLAN_CACHE_ENABLED", "true").lower() == "true",
+    # Embedding lookup for reworded questions (costs one cached embedding call on an exact miss)
+    "semantic": os.getenv("SQL_PLAN_CACHE_SEMANTIC", "true").lower() == "true",
+    "threshold": float(os.getenv("SQL_PLAN_CACHE_THRESHOLD", "0.95")),
+    "max_size": int(os.getenv("SQL_PLAN_CACHE_MAX_SIZE", "500"))
+}
+
+# Currency and metal codes recognised as symbol slots ("EUR/USD", "eurusd")
+CURRENCY_CODES = {
+    "EUR", "USD", "GBP", "JPY", "AUD", "NZD", "CAD", "CHF",
+    "SEK", "NOK", "DKK", "PLN", "HUF", "CZK", "TRY", "ZAR",
+    "MXN", "SGD", "HKD", "CNH", "XAU", "XAG"
+}
+
+SYMBOL = "symbol"
+DATE = "date"
+
+_SYMBOL_PATTERN = re.compile(r"\b([A-Za-z]{3})/?([A-Za-z]{3})\b")
+_DATE_PATTERN = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+
+# Words that change the SQL but barely move an embedding; reworded matches must agree on them
+_PINNED_PATTERN = re.compile(
+    r"\b(\d+(?:\.\d+)?|jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?"
+    r"|sep(?:tember)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?|today|yesterday|day|week|month|year"
+    r"|quarter|last|this|previous|current|best|worst|highest|lowest|most|least|top|bottom"
+    r"|average|total|percentage|count|daily|weekly|monthly|yearly"
+    r"|profits?|profitable|loss|losses|losing|lose|lost|pnl|gains?|win|wins|winning|won"
+    r"|commissions?|fees?|swaps?|buys?|bought|sells?|sold|long|short|lots?|volume)\b"
+)
+_SQL_TOKEN = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|\$\d+|\b\d+(?:\.\d+)?\b""")
+# Date parts and interval units, as in DATE_TRUNC('month', ...) and INTERVAL '3 months'
+_TIME_UNIT = re.compile(
+    r"(microsecond|millisecond|second|minute|hour|day|week|month|quarter|year|decade|century|isodow|dow|doy|epoch)s?"
+)
+# Numbers that shape a query rather than pick its data (LIMIT 1, > 0, * 100.0)
+_STRUCTURAL_NUMBERS = {"0", "1", "100", "100.0"}
+
+
+def extract_slots(query: str) -> List[Dict[str, Any]]:
+    """Symbols and ISO dates in the query, in order of appearance."""
+    slots = []
+    for match in _SYMBOL_PATTERN.finditer(query):
+        base, quote = match.group(1).upper(), match.group(2).upper()
+        if base in CURRENCY_CODES and quote in CURRENCY_CODES:
+            slots.append({"type": SYMBOL, "span": match.span(), "text": match.group(0), "value": f"{base}/{quote}"})
+    for match in _DATE_PATTERN.finditer(query):
+        try:
+            value = date.fromisoformat(match.group(1))
+        except ValueError:
+            continue
+        slots.append({"type": DATE, "span": match.span(), "text": match.group(0), "value": value})
+    return sorted(slots, key=lambda slot: slot["span"])
+
+
+def question_template(query: str, slots: List[Dict[str, Any]]) -> str:
+    """The normalized query with each slot replaced by its type, e.g. "my profit on <symbol>"."""
+    parts, end = [], 0
+    for slot in slots:
+        start, stop = slot["span"]
+        parts.append(query[end:start])
+        parts.append(f"<{slot['type']}>")
+        end = stop
+    parts.append(query[end:])
+    return normalize_text("".join(parts))
+
+
+def _signature(template: str, slots: List[Dict[str, Any]]) -> tuple:
+    return tuple(slot["type"] for slot in slots), tuple(_PINNED_PATTERN.findall(template))
+
+
+def _sql_literal(slot: Dict[str, Any]) -> str:
+    value = slot["value"]
+    return f"'{value.isoformat() if isinstance(value, date) else value}'"
+
+
+def parameterize(sql: str, slots: List[Dict[str, Any]], query_template: str) -> Optional[Dict[str, Any]]:
+    """Replace each slot's literal in the SQL with a positional parameter.
+
+    Returns {"sql", "params"} where params lists the slot index behind each
+    $n, or None when the SQL hard-codes something the slots can't vary: a
+    slot's literal is missing or shared by two slots, or a literal or
+    number is left that came from neither a slot nor the question's pinned
+    words (a "last month" question answered with fixed dates, or "gold"
+    answered with 'XAU/USD', which "silver" would otherwise reuse). String
+    literals may only hold date parts, interval units and pinned words
+    ('Buy' for a question pinned on "buy").
+    """
+    if "$" in sql:
+        return None
+
+    literals = [_sql_literal(slot) for slot in slots]
+    if len(set(literals)) != len(literals):
+        return None
+
+    params = []
+    for index, literal in enumerate(literals):
+        if literal not in sql:
+            return None
+        params.append(index)
+        sql = sql.replace(literal, f"${len(params)}")
+
+    allowed = _STRUCTURAL_NUMBERS | set(_PINNED_PATTERN.findall(query_template))
+    for token in _SQL_TOKEN.findall(sql):
+        if token.startswith("'"):
+            words = token[1:-1].lower().split()
+            if not words or any(word not in allowed and not _TIME_UNIT.fullmatch(word) for word in words):
+                return None
+        elif token[0].isdigit() and token not in allowed:
+            return None
+    return {"sql": sql, "params": params}
+
+
+def successful_sql(messages: List) -> Optional[str]:
+    """The last query validate_and_execute ran successfully in an agent run."""
+    calls = {}
+    sql = None
+    for message in messages:
+        for tool_call in getattr(message, "tool_calls", None) or []:
+            if tool_call.get("name") == "validate_and_execute":
+                calls[tool_call.get("id")] = tool_call.get("args", {}).get("sql_query")
+        if getattr(message, "type", None) == "tool" and str(message.content).startswith("VALIDATION PASSED"):
+            sql = calls.get(getattr(message, "tool_call_id", None)) or sql
+    return sql
+
+
+def _format_value(value) -> str:
+    if isinstance(value, (float, Decimal)):
+        return f"{value:,.2f}"
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def format_result(rows: List) -> str:
+    """Neutral reply for a cached plan's rows: "Label: value" lines for one row, else a table."""
+    if not rows:
+        return "No matching trades were found."
+    if len(rows) == 1:
+        return "\n".join(
+            f"{name.replace('_', ' ').strip().capitalize()}: {_format_value(value)}"
+            for name, value in rows[0].items()
+        )
+    return f"Here are the results:\n\n{format_rows(rows)}\n\nRows: {len(rows)}"
+
+
+class SQLPlanCache:
+    """Cache of validated SQL keyed on the slot-templated user question.
+
+    Symbols and ISO dates in a question are slots: "profit on EUR/USD" and
+    "profit on GBP/USD" share the template "profit on <symbol>" and one
+    parameterized SQL statement. A question is matched by its exact
+    template, or, when semantic lookup is on, by cosine similarity to a
+    stored template with the same slots and the same pinned words
+    (numbers, months, periods, ordering, metrics, sides). A hit runs the
+    stored SQL on the SQL agent's pool and replies with its rows in a fixed
+    format, so no LLM call is made and no wording from another answer is
+    reused.
+    """
+
+    def __init__(self, enabled: bool = None, semantic: bool = None, threshold: float = None, max_size: int = None):
+        self.enabled = SQL_PLAN_CACHE_CONFIG["enabled"] if enabled is None else enabled
+        self.semantic = SQL_PLAN_CACHE_CONFIG["semantic"] if semantic is None else semantic
+        self.threshold = threshold if threshold is not None else SQL_PLAN_CACHE_CONFIG["threshold"]
+        self.max_size = max_size if max_size is not None else SQL_PLAN_CACHE_CONFIG["max_size"]
+        self._embed: Optional[Callable[[str], Awaitable[List[float]]]] = None
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._tasks = set()
+        self._stats = {
+            "exact_hits": 0, "similar_hits": 0, "misses": 0, "stores": 0, "rejected": 0,
+            "errors": 0, "evictions": 0, "hit_ms": 0.0, "saved_ms": 0.0
+        }
+
+    async def initialize(self, embed_query: Callable[[str], Awaitable[List[float]]]):
+        """Attach the (cached) query embedding function used for reworded questions."""
+        self._embed = embed_query
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def _find(self, template: str, signature: tuple) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(text_key(template))
+        if entry is not None:
+            self._stats["exact_hits"] += 1
+            return entry
+
+        if not (self.semantic and self._embed):
+            return None
+        candidates = [
+            entry for entry in self._entries.values()
+            if entry["signature"] == signature and entry["embedding"] is not None
+        ]
+        if not candidates:
+            return None
+
+        similarities = np.stack([entry["embedding"] for entry in candidates]) @ self._unit(await self._embed(template))
+        best = int(np.argmax(similarities))
+        if float(similarities[best]) < self.threshold:
+            return None
+        self._stats["similar_hits"] += 1
+        return candidates[best]
+
+    async def answer(self, query: str) -> Optional[str]:
+        """Answer a trading-data question from a cached plan, or return None on a miss."""
+        if not self.enabled:
+            return None
+
+        start = time.perf_counter()
+        slots = extract_slots(query)
+        template = question_template(query, slots)
+        entry = await self._find(template, _signature(template, slots))
+        if entry is None:
+            self._stats["misses"] += 1
+            return None
+
+        try:
+            rows = await run_select(entry["sql"], *(slots[i]["value"] for i in entry["params"]))
+        except AccountScopeError:
+            # The plan is fine; the agent explains why this request can't be answered
+            return None
+        except Exception as e:
+            # The stored SQL no longer runs (schema change?): forget it and let the agent regenerate
+            print(f"⚠️ Dropping cached SQL plan for '{entry['template']}': {e}")
+            self._entries.pop(entry["key"], None)
+            self._stats["errors"] += 1
+            return None
+        self._entries.move_to_end(entry["key"])
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._stats["hit_ms"] += elapsed_ms
+        self._stats["saved_ms"] += max(0.0, entry["generation_ms"] - elapsed_ms)
+        return format_result(rows)
+
+    def remember(self, query: str, messages: List, generation_ms: float):
+        """Cache the SQL an agent run validated for query, in the background."""
+        if not self.enabled:
+            return
+        task = asyncio.create_task(self._store(query, messages, generation_ms))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _store(self, query: str, messages: List, generation_ms: float):
+        sql = successful_sql(messages)
+        if not sql:
+            return
+
+        slots = extract_slots(query)
+        template = question_template(query, slots)
+        plan = parameterize(sql.strip().rstrip(";"), slots, template)
+        if plan is None:
+            self._stats["rejected"] += 1
+            return
+
+        try:
+            # Re-running with the original values proves the parameterized SQL still works
+            await run_select(plan["sql"], *(slots[i]["value"] for i in plan["params"]))
+            embedding = self._unit(await self._embed(template)) if self.semantic and self._embed else None
+        except Exception as e:
+            print(f"⚠️ Not caching SQL plan for '{template}': {e}")
+            self._stats["rejected"] += 1
+            return
+
+        key = text_key(template)
+        self._entries[key] = {
+            "key": key,
+            "template": template,
+            "signature": _signature(template, slots),
+            "sql": plan["sql"],
+            "params": plan["params"],
+            "embedding": embedding,
+            "generation_ms": generation_ms
+        }
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+        self._stats["stores"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters, current size and latency saved by skipping SQL generation."""
+        hits = self._stats["exact_hits"] + self._stats["similar_hits"]
+        lookups = hits + self._stats["misses"]
+        return {
+            **{name: count for name, count in self._stats.items() if name not in ("hit_ms", "saved_ms")},
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "avg_hit_ms": round(self._stats["hit_ms"] / hits, 3) if hits else 0.0,
+            "saved_ms": round(self._stats["saved_ms"], 3),
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "semantic": self.semantic,
+            "threshold": self.threshold
+        }
@@ -6,18 +6,29 @@ Uses Deep Agent with RAG and SQL subagents
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List, Set, Dict, Any
 import asyncio
+import json
 import os
+import time
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 # Import agents
 from app.services_v1.rag_agent_core import RAGAgent, load_csv_files
-from app.services_v1.sql_agent_core import sql_agent, init_db_pool, cleanup_db_pool
-from app.services_v1.constants import DEEP_AGENT_PROMPT
+from app.services_v1.sql_agent_core import sql_agent, init_db_pool, cleanup_db_pool, RESULT_CACHE
+from app.services_v1.constants import DEEP_AGENT_PROMPT, GREETING_RESPONSE
+from app.services_v1.cache_core import SemanticCache, SingleFlight, RESPONSE_CACHE_CONFIG, text_key
+from app.services_v1.router_core import QueryRouter, QUERY_ROUTER_CONFIG, is_personal_query, is_follow_up
+from app.services_v1 import router_core
+from app.services_v1.session_core import SessionStore, SESSION_CONFIG
+from app.services_v1.admission_core import AdmissionController, AdmissionRejected
+from app.services_v1.sql_plan_core import SQLPlanCache
+from app.services_v1.account_core import account_scope, CURRENT_ACCOUNT
+from app.services_v1.rate_limit import get_llm_rate_limiter
 
 # Import LangChain and DeepAgents
 from langchain_google_genai import ChatGoogleGenerativeAI
@@ -27,13 +38,21 @@ load_dotenv()
 
 # Global instances
 deep_agent = None
+session_agent = None  # deep agent with a checkpointer, for requests with a session_id
+session_store = SessionStore()
+admission = AdmissionController()
 rag_agent_instance = None
+response_cache = SemanticCache()
+in_flight_queries = SingleFlight()
+query_router = QueryRouter()
+sql_plan_cache = SQLPlanCache()
 
 
 # Request/Response Models
 class QueryRequest(BaseModel):
     query: str
     session_id: Optional[str] = None
+    account_id: Optional[str] = None  # trading-data queries only see this account's trades
 
 
 class QueryResponse(BaseModel):
@@ -41,13 +60,35 @@ class QueryResponse(BaseModel):
     response: str
     query: Optional[str] = None
     session_id: Optional[str] = None
+    cached: bool = False
+    route: Optional[str] = None
+
+
+def _extract_answer(messages: List) -> str:
+    """Return the content of the last message that has any."""
+    for message in reversed(messages):
+        if hasattr(message, 'content') and message.content:
+            return message.content
+        elif isinstance(message, dict) and message.get("content"):
+            return message.get("content")
+    return "I couldn't generate a response."
+
+
+def _called_subagents(messages: List) -> Set[str]:
+    """Names of the sub-agents the orchestrator delegated to via the task tool."""
+    subagents = set()
+    for message in messages:
+        for tool_call in getattr(message, 'tool_calls', None) or []:
+            if tool_call.get("name") == "task":
+                subagents.add(tool_call.get("args", {}).get("subagent_type"))
+    return subagents
 
 
 # Lifespan context manager for startup/shutdown
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Handle startup and shutdown events"""
-    global deep_agent, rag_agent_instance
+    global deep_agent, session_agent, rag_agent_instance
     
     # Startup
     print("🚀 Starting HFM Deep Agent Chatbot...")
@@ -62,7 +103,8 @@ async def lifespan(app: FastAPI):
             model="gemini-2.0-flash",
             temperature=0,
             google_api_key=api_key,
-            max_output_tokens=2000
+            max_output_tokens=2000,
+            rate_limiter=get_llm_rate_limiter("gemini-2.0-flash")
         )
         
         # Initialize SQL Agent DB Pool
@@ -74,6 +116,8 @@ async def lifespan(app: FastAPI):
         rag_agent_instance = RAGAgent()
         await rag_agent_instance.initialize()
         await load_csv_files(rag_agent_instance)
+        await query_router.initialize(rag_agent_instance.vector_store)
+        await sql_plan_cache.initialize(rag_agent_instance.vector_store.embed_query)
         
         # Create RAG SubAgent
         rag_subagent = CompiledSubAgent(
@@ -97,6 +141,17 @@ async def lifespan(app: FastAPI):
             system_prompt=DEEP_AGENT_PROMPT
         )
         
+        # Same agent with per-session memory, history capped by summarizing older turns
+        if SESSION_CONFIG["enabled"]:
+            await session_store.initialize()
+            session_agent = create_deep_agent(
+                model=llm,
+                subagents=[rag_subagent, sql_subagent],
+                system_prompt=DEEP_AGENT_PROMPT,
+                middleware=[session_store.summarization_middleware(llm)],
+                checkpointer=session_store.checkpointer
+            )
+        
         print("✅ Deep Agent initialized successfully with RAG and SQL subagents")
     except Exception as e:
         print(f"❌ Failed to initialize Deep Agent: {e}")
@@ -107,6 +162,9 @@ async def lifespan(app: FastAPI):
     # Shutdown
     print("👋 Shutting down HFM Deep Agent Chatbot...")
     await cleanup_db_pool()
+    if rag_agent_instance is not None:
+        await rag_agent_instance.vector_store.close()
+    await session_store.close()
 
 
 # Create FastAPI app
@@ -149,13 +207,34 @@ async def health_check():
     }
 
 
+# Metrics endpoint
+@app.get("/api/v1/metrics")
+async def metrics():
+    """Runtime performance metrics"""
+    return {
+        "vector_store_pool": rag_agent_instance.vector_store.pool_stats() if rag_agent_instance else None,
+        "embedding_cache": rag_agent_instance.vector_store.embedding_cache.stats() if rag_agent_instance else None,
+        "search_context": rag_agent_instance.search_tool.context_builder.stats() if rag_agent_instance else None,
+        "response_cache": response_cache.stats(),
+        "router": query_router.stats(),
+        "sql_plan_cache": sql_plan_cache.stats(),
+        "sql_result_cache": RESULT_CACHE.stats(),
+        "rag_direct": rag_agent_instance.direct_answer_stats if rag_agent_instance else None,
+        "sessions": session_store.stats() if session_agent is not None else None,
+        "admission": admission.stats(),
+        "coalescing": in_flight_queries.stats()
+    }
+
+
 # Main query endpoint for UI
 @app.post("/api/v1/query", response_model=QueryResponse)
 async def query_deep_agent(request: QueryRequest):
     """
     Query the Deep Agent with RAG and SQL subagents (UI endpoint)
     
-    The Deep Agent will automatically:
+    Greetings are answered directly and clear-cut knowledge or trading-data
+    questions go straight to the RAG or SQL Agent. Everything else goes to
+    the Deep Agent, which will:
     - Route knowledge questions to RAG Agent
     - Route trading data queries to SQL Agent
     - Combine both when needed
@@ -166,44 +245,281 @@ async def query_deep_agent(request: QueryRequest):
     Returns:
         QueryResponse with success and response
     """
+    _check_query(request)
+    
+    try:
+        with account_scope(request.account_id):
+            if request.session_id:
+                return await _answer_query(request)
+            
+            # Concurrent requests for the same (normalized) question and account share one run
+            key = f"{request.account_id or ''}:{text_key(request.query)}"
+            response = await in_flight_queries.do(key, lambda: _answer_query(request))
+        return response.model_copy(update={"query": request.query})
+    
+    except AdmissionRejected as e:
+        raise _busy(e)
+    
+    except Exception as e:
+        return QueryResponse(
+            success=False,
+            response=f"Error processing query: {str(e)}",
+            query=request.query,
+            session_id=request.session_id
+        )
+
+
+# Streaming query endpoint for UI
+@app.post("/api/v1/query/stream")
+async def stream_deep_agent(request: QueryRequest):
+    """
+    Stream a query's progress and answer as Server-Sent Events
+    
+    Routing is the same as /api/v1/query. Events:
+    - route: {"route"} once the path is chosen
+    - subagent: {"name", "status"} when the Deep Agent delegates to a sub-agent
+    - tool: {"name", "status"} when a tool starts or finishes
+    - token: {"text"} answer tokens as the model produces them
+    - done: the final QueryResponse
+    - error: {"message"}
+    
+    Answers 503 with Retry-After when the worker is at capacity.
+    """
+    _check_query(request)
+    
+    slot = None
+    try:
+        with account_scope(request.account_id):
+            plan = await _plan_query(request)
+        if plan["response"] is None:
+            slot = await admission.acquire()
+    except AdmissionRejected as e:
+        raise _busy(e)
+    except Exception as e:
+        return _event_stream(_error_events(e))
+    
+    release = slot.release if slot else None
+    return _event_stream(_stream_query(request, plan, release), BackgroundTask(release) if release else None)
+
+
+def _busy(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def _event_stream(events, background: BackgroundTask = None) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=background
+    )
+
+
+async def _error_events(e: Exception):
+    yield _sse("error", {"message": f"Error processing query: {str(e)}"})
+
+
+async def _answer_query(request: QueryRequest) -> QueryResponse:
+    plan = await _plan_query(request)
+    if plan["response"] is not None:
+        return plan["response"]
+    
+    # Agent runs call the LLM, so they wait for a slot (or are turned away when overloaded)
+    async with admission.slot():
+        plan["agent_started"] = time.perf_counter()
+        response = await plan["agent"].ainvoke(_agent_input(request), config=plan["config"])
+    return await _complete_query(request, plan, response.get("messages", []))
+
+
+def _check_query(request: QueryRequest):
     if deep_agent is None:
         raise HTTPException(status_code=503, detail="Deep agent not initialized")
     
     if not request.query.strip():
         raise HTTPException(status_code=400, detail="Query cannot be empty")
+
+
+def _agent_input(request: QueryRequest) -> Dict[str, Any]:
+    return {"messages": [{"role": "user", "content": request.query}]}
+
+
+async def _plan_query(request: QueryRequest) -> Dict[str, Any]:
+    """Decide how to answer a query: an immediate response, or the agent to run.
     
-    try:
-        # Query the deep agent
-        response = await deep_agent.ainvoke({
-            "messages": [{"role": "user", "content": request.query}]
-        })
-        
-        # Extract answer from response
-        messages = response.get("messages", [])
-        answer = "I couldn't generate a response."
-        
-        for message in reversed(messages):
-            if hasattr(message, 'content') and message.content:
-                answer = message.content
-                break
-            elif isinstance(message, dict) and message.get("content"):
-                answer = message.get("content")
-                break
-        
-        return QueryResponse(
+    Returns a dict with route, response (a QueryResponse when no agent is
+    needed), agent, config (the agent run config), cacheable, query_embedding
+    and agent_started (set when the agent run begins).
+    """
+    plan = {
+        "route": None, "response": None, "agent": None, "config": None,
+        "cacheable": False, "query_embedding": None, "agent_started": None
+    }
+    session = bool(request.session_id) and session_agent is not None
+    
+    async def respond(route: str, answer: str, cached: bool = False) -> Dict[str, Any]:
+        plan["route"] = route
+        plan["response"] = QueryResponse(
             success=True,
             response=answer,
             query=request.query,
-            session_id=request.session_id
+            session_id=request.session_id,
+            cached=cached,
+            route=route
         )
+        await _record_session_turn(request, plan, answer)
+        return plan
+    
+    # Clear-cut intents skip the orchestrator LLM
+    route = query_router.classify(request.query) if QUERY_ROUTER_CONFIG["enabled"] else router_core.UNKNOWN
+    if session:
+        await session_store.touch(request.session_id)
+    if route == router_core.GREETING:
+        return await respond(route, GREETING_RESPONSE)
+    
+    # Follow-ups refer to earlier turns, so the session's deep agent answers them with the
+    # history; self-contained questions still take the fast paths below and join the history
+    if session and is_follow_up(request.query) and await session_store.has_history(request.session_id):
+        plan["route"] = "session"
+        plan["agent"] = session_agent
+        plan["config"] = session_store.config(request.session_id)
+        return plan
+    
+    # Serve near-duplicate knowledge-base questions from the semantic cache.
+    # Questions about the user's own trading data are never cached.
+    plan["cacheable"] = RESPONSE_CACHE_CONFIG["enabled"] and not is_personal_query(request.query)
+    if plan["cacheable"]:
+        plan["query_embedding"] = await rag_agent_instance.vector_store.embed_query(request.query)
+        cached = response_cache.lookup(plan["query_embedding"])
+        if cached:
+            return await respond("cache", cached["value"], cached=True)
+    
+    if route == router_core.UNKNOWN and query_router.classifier_ready:
+        if plan["query_embedding"] is None:
+            plan["query_embedding"] = await rag_agent_instance.vector_store.embed_query(request.query)
+        route = query_router.classify_embedding(plan["query_embedding"])
+    
+    # Strong knowledge-base matches return the curated answer without LLM synthesis
+    if route in (router_core.RAG, router_core.UNKNOWN):
+        direct = await rag_agent_instance.try_direct_answer(request.query)
+        if direct:
+            return await respond("rag_direct", direct["answer"])
+    
+    # Repeated trading-data question shapes reuse validated SQL instead of regenerating it
+    if route == router_core.SQL:
+        answer = await sql_plan_cache.answer(request.query)
+        if answer is not None:
+            return await respond("sql_plan", answer)
+    
+    if route == router_core.RAG:
+        plan["agent"] = rag_agent_instance.agent
+    elif route == router_core.SQL:
+        plan["agent"] = sql_agent
+    elif session:
+        # Mixed or ambiguous: the session's deep agent plans, and keeps the tool results for follow-ups
+        route = "session"
+        plan["agent"] = session_agent
+        plan["config"] = session_store.config(request.session_id)
+    else:
+        # Mixed or ambiguous: let the deep agent plan and delegate
+        route = "deep_agent"
+        plan["agent"] = deep_agent
+    plan["route"] = route
+    return plan
+
+
+async def _record_session_turn(request: QueryRequest, plan: Dict[str, Any], answer: str):
+    """Add a turn answered outside the session agent to the session's history."""
+    if request.session_id and session_agent is not None and plan["agent"] is not session_agent:
+        await session_store.record_turn(session_agent, request.session_id, request.query, answer)
+
+
+async def _complete_query(request: QueryRequest, plan: Dict[str, Any], messages: List) -> QueryResponse:
+    """Build the response from the agent's messages, cache it if it is safe to share, and record it in the session."""
+    answer = _extract_answer(messages)
+    
+    # Only pure RAG answers are safe to share between users
+    rag_only = plan["route"] == router_core.RAG or _called_subagents(messages) == {"RAG_Agent"}
+    if plan["cacheable"] and rag_only:
+        response_cache.store(request.query, plan["query_embedding"], answer)
+    if plan["route"] == router_core.SQL and plan["agent_started"] is not None:
+        generation_ms = (time.perf_counter() - plan["agent_started"]) * 1000
+        sql_plan_cache.remember(request.query, messages, generation_ms)
+    await _record_session_turn(request, plan, answer)
+    
+    return QueryResponse(
+        success=True,
+        response=answer,
+        query=request.query,
+        session_id=request.session_id,
+        route=plan["route"]
+    )
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _chunk_text(chunk) -> str:
+    """Text of a streamed message chunk (Gemini may send a list of content parts)."""
+    content = getattr(chunk, "content", "")
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+
+async def _stream_query(request: QueryRequest, plan: Dict[str, Any], release=None):
+    """Run a planned query through astream_events and translate the events into SSE frames.
+    
+    release frees the admission slot held for the agent run (it is also
+    attached as the response's background task, in case the stream never starts).
+    """
+    # The stream runs after the endpoint returns, outside its account_scope block
+    CURRENT_ACCOUNT.set(request.account_id or None)
+    try:
+        yield _sse("route", {"route": plan["route"]})
+        if plan["response"] is not None:
+            yield _sse("done", plan["response"].model_dump())
+            return
+        
+        # Tokens from models running inside a tool (sub-agents, SQL generation) are progress,
+        # not the answer, so only stream tokens with no active tool run among their parents
+        active_tools: Dict[str, str] = {}  # run_id -> tool or sub-agent name
+        messages = []
+        plan["agent_started"] = time.perf_counter()
+        async for event in plan["agent"].astream_events(_agent_input(request), config=plan["config"], version="v2"):
+            kind = event["event"]
+            if kind in ("on_tool_start", "on_tool_end"):
+                # The deep agent delegates through its "task" tool
+                is_subagent = event["name"] == "task"
+                if kind == "on_tool_start":
+                    tool_input = event["data"].get("input") or {}
+                    name = tool_input.get("subagent_type") if is_subagent else event["name"]
+                    active_tools[event["run_id"]] = name
+                    status = "start"
+                else:
+                    name = active_tools.pop(event["run_id"], event["name"])
+                    status = "end"
+                yield _sse("subagent" if is_subagent else "tool", {"name": name, "status": status})
+            
+            elif kind == "on_chat_model_stream" and not active_tools.keys() & set(event.get("parent_ids", [])):
+                text = _chunk_text(event["data"]["chunk"])
+                if text:
+                    yield _sse("token", {"text": text})
+            
+            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                output = event["data"].get("output") or {}
+                messages = output.get("messages", []) if isinstance(output, dict) else []
+        
+        if release:
+            release()
+        yield _sse("done", (await _complete_query(request, plan, messages)).model_dump())
     
     except Exception as e:
-        return QueryResponse(
-            success=False,
-            response=f"Error processing query: {str(e)}",
-            query=request.query,
-            session_id=request.session_id
-        )
+        yield _sse("error", {"message": f"Error processing query: {str(e)}"})
+    
+    finally:
+        if release:
+            release()
 
 
 # Root endpoint
@@ -221,6 +537,8 @@ async def root():
             "ui": "/",
             "health": "/health",
             "query": "/api/v1/query (POST)",
+            "query_stream": "/api/v1/query/stream (POST, Server-Sent Events)",
+            "metrics": "/api/v1/metrics",
             "docs": "/docs"
         }
     }
@@ -29,6 +29,30 @@ CREATE INDEX IF NOT EXISTS idx_trade_date ON forex_trades("Trade_Date");
 CREATE INDEX IF NOT EXISTS idx_symbol ON forex_trades("Symbol");
 CREATE INDEX IF NOT EXISTS idx_daily_pnl ON forex_trades("Daily_PnL");
 
+-- Covering indexes for account-scoped queries (the app also builds these on startup)
+CREATE INDEX IF NOT EXISTS idx_account_date ON forex_trades("Account_ID", "Trade_Date") INCLUDE ("Daily_PnL", "Symbol");
+CREATE INDEX IF NOT EXISTS idx_account_symbol ON forex_trades("Account_ID", "Symbol", "Trade_Date") INCLUDE ("Daily_PnL");
+
+-- Change counter for the SQL agent's result cache (also installed on startup)
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO table_versions (table_name, version) VALUES (TG_TABLE_NAME, 1)
+    ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+INSERT INTO table_versions (table_name) VALUES ('forex_trades') ON CONFLICT DO NOTHING;
+DROP TRIGGER IF EXISTS forex_trades_version_bump ON forex_trades;
+CREATE TRIGGER forex_trades_version_bump
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON forex_trades
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
 -- Insert dummy data (100+ records with realistic forex trading data)
 INSERT INTO forex_trades ("Trade_Date", "Symbol", "Trade_Type", "Entry_Price", "Exit_Price", "Lot_Size", "Daily_PnL", "Commission", "Swap", "Duration_Minutes", "Account_ID", "Status", "Notes")
 VALUES
@@ -133,6 +157,10 @@ VALUES
 ('2024-05-13', 'EUR/USD', 'Buy', 1.08500, 1.09200, 2.40, 1680.00, -14.00, -4.80, 540, 'ACC001', 'Closed', 'Strong trend'),
 ('2024-05-14', 'GBP/JPY', 'Sell', 196.80, 196.20, 1.10, 660.00, -8.00, -2.90, 360, 'ACC001', 'Closed', 'Profit taking');
 
+-- The app also keeps forex_trades_daily and forex_trades_monthly rollups (per account, symbol
+-- and period) up to date with statement triggers, see app/services_v1/rollup_core.py.
+-- The SQL agent answers summaries like the ones below from those instead of scanning every trade.
+
 -- Display summary statistics
 SELECT 
     COUNT(*) as total_trades,
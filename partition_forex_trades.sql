@@ -0,0 +1,79 @@
+-- Optional: partition forex_trades by account
+-- Database: hfm_assistant
+--
+-- Converts forex_trades into a table hash-partitioned on "Account_ID", so an account-scoped
+-- query only touches one partition. Run it once in a maintenance window (writes are blocked
+-- while rows are copied), then restart the app: on startup it installs the rollup and
+-- result-cache triggers on the new table and rebuilds the rollups.
+-- Drop forex_trades_unpartitioned once everything checks out.
+
+BEGIN;
+
+LOCK TABLE forex_trades IN EXCLUSIVE MODE;
+
+-- Free the index names for the new table
+ALTER INDEX IF EXISTS idx_trade_date RENAME TO idx_trade_date_unpartitioned;
+ALTER INDEX IF EXISTS idx_symbol RENAME TO idx_symbol_unpartitioned;
+ALTER INDEX IF EXISTS idx_daily_pnl RENAME TO idx_daily_pnl_unpartitioned;
+ALTER INDEX IF EXISTS idx_account_date RENAME TO idx_account_date_unpartitioned;
+ALTER INDEX IF EXISTS idx_account_symbol RENAME TO idx_account_symbol_unpartitioned;
+
+CREATE SEQUENCE IF NOT EXISTS forex_trades_trade_id_seq;
+
+-- The partition key must be part of the primary key, so "Account_ID" becomes NOT NULL
+-- (missing accounts are stored as '', as in the rollups)
+CREATE TABLE forex_trades_partitioned (
+    "Trade_ID" INTEGER NOT NULL DEFAULT nextval('forex_trades_trade_id_seq'),
+    "Trade_Date" DATE NOT NULL,
+    "Symbol" VARCHAR(20) NOT NULL,
+    "Trade_Type" VARCHAR(10) NOT NULL, -- 'Buy' or 'Sell'
+    "Entry_Price" DECIMAL(10, 5) NOT NULL,
+    "Exit_Price" DECIMAL(10, 5),
+    "Lot_Size" DECIMAL(10, 2) NOT NULL,
+    "Daily_PnL" DECIMAL(15, 2) NOT NULL,
+    "Commission" DECIMAL(10, 2) DEFAULT 0.00,
+    "Swap" DECIMAL(10, 2) DEFAULT 0.00,
+    "Duration_Minutes" INTEGER,
+    "Account_ID" VARCHAR(50) NOT NULL DEFAULT '',
+    "Status" VARCHAR(20) DEFAULT 'Closed',
+    "Notes" TEXT,
+    "Created_At" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY ("Account_ID", "Trade_ID")
+) PARTITION BY HASH ("Account_ID");
+
+CREATE TABLE forex_trades_p0 PARTITION OF forex_trades_partitioned FOR VALUES WITH (MODULUS 8, REMAINDER 0);
+CREATE TABLE forex_trades_p1 PARTITION OF forex_trades_partitioned FOR VALUES WITH (MODULUS 8, REMAINDER 1);
+CREATE TABLE forex_trades_p2 PARTITION OF forex_trades_partitioned FOR VALUES WITH (MODULUS 8, REMAINDER 2);
+CREATE TABLE forex_trades_p3 PARTITION OF forex_trades_partitioned FOR VALUES WITH (MODULUS 8, REMAINDER 3);
+CREATE TABLE forex_trades_p4 PARTITION OF forex_trades_partitioned FOR VALUES WITH (MODULUS 8, REMAINDER 4);
+CREATE TABLE forex_trades_p5 PARTITION OF forex_trades_partitioned FOR VALUES WITH (MODULUS 8, REMAINDER 5);
+CREATE TABLE forex_trades_p6 PARTITION OF forex_trades_partitioned FOR VALUES WITH (MODULUS 8, REMAINDER 6);
+CREATE TABLE forex_trades_p7 PARTITION OF forex_trades_partitioned FOR VALUES WITH (MODULUS 8, REMAINDER 7);
+
+INSERT INTO forex_trades_partitioned ("Trade_ID", "Trade_Date", "Symbol", "Trade_Type", "Entry_Price", "Exit_Price", "Lot_Size", "Daily_PnL", "Commission", "Swap", "Duration_Minutes", "Account_ID", "Status", "Notes", "Created_At")
+SELECT "Trade_ID", "Trade_Date", "Symbol", "Trade_Type", "Entry_Price", "Exit_Price", "Lot_Size", "Daily_PnL", "Commission", "Swap", "Duration_Minutes", COALESCE("Account_ID", ''), "Status", "Notes", "Created_At"
+FROM forex_trades;
+
+SELECT setval('forex_trades_trade_id_seq', COALESCE((SELECT MAX("Trade_ID") FROM forex_trades_partitioned), 0) + 1, false);
+
+CREATE INDEX idx_trade_date ON forex_trades_partitioned("Trade_Date");
+CREATE INDEX idx_symbol ON forex_trades_partitioned("Symbol");
+CREATE INDEX idx_daily_pnl ON forex_trades_partitioned("Daily_PnL");
+CREATE INDEX idx_account_date ON forex_trades_partitioned("Account_ID", "Trade_Date") INCLUDE ("Daily_PnL", "Symbol");
+CREATE INDEX idx_account_symbol ON forex_trades_partitioned("Account_ID", "Symbol", "Trade_Date") INCLUDE ("Daily_PnL");
+
+-- Writes to the old table must no longer reach the rollups or the result-cache counter
+DROP TRIGGER IF EXISTS forex_trades_rollup_insert ON forex_trades;
+DROP TRIGGER IF EXISTS forex_trades_rollup_update ON forex_trades;
+DROP TRIGGER IF EXISTS forex_trades_rollup_delete ON forex_trades;
+DROP TRIGGER IF EXISTS forex_trades_rollup_truncate ON forex_trades;
+DROP TRIGGER IF EXISTS forex_trades_version_bump ON forex_trades;
+
+ALTER TABLE forex_trades RENAME TO forex_trades_unpartitioned;
+ALTER TABLE forex_trades_partitioned RENAME TO forex_trades;
+ALTER SEQUENCE forex_trades_trade_id_seq OWNED BY forex_trades."Trade_ID";
+
+-- Cached results were read from the old table
+UPDATE table_versions SET version = version + 1 WHERE table_name = 'forex_trades';
+
+COMMIT;
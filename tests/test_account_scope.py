@@ -0,0 +1,28 @@
+import pytest
+
+from app.services_v1.account_core import AccountScopeError
+from app.services_v1.account_core import scope_sql
+
+SCOPED = '(SELECT * FROM forex_trades WHERE "Account_ID" = $1)'
+
+
+def test_table_references_are_scoped():
+    sql = scope_sql('SELECT SUM("Daily_PnL") FROM forex_trades f JOIN public.forex_trades g ON true', 1)
+    assert sql == f'SELECT SUM("Daily_PnL") FROM {SCOPED} f JOIN {SCOPED} g ON true'
+
+
+def test_unaliased_reference_keeps_its_name():
+    assert scope_sql("SELECT COUNT(*) FROM forex_trades WHERE true", 1) == f"SELECT COUNT(*) FROM {SCOPED} AS forex_trades WHERE true"
+
+
+@pytest.mark.parametrize("sql", [
+    'SELECT "Account_ID", SUM("Daily_PnL") -- "\nFROM forex_trades GROUP BY 1 -- "\nHAVING true',
+    'SELECT 1 /* " */ FROM forex_trades',
+    "SELECT E'\\'' FROM forex_trades --'",
+    "SELECT $$'$$ FROM forex_trades",
+    'SELECT U&"\\0066orex_trades" FROM forex_trades',
+    "SELECT * FROM query_to_xml('select * from forex_trades', true, true, '')",
+])
+def test_sql_that_could_escape_the_scope_is_refused(sql):
+    with pytest.raises(AccountScopeError):
+        scope_sql(sql, 1)
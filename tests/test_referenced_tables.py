@@ -0,0 +1,27 @@
+import pytest
+
+from app.services_v1.cache_core import referenced_tables
+
+
+@pytest.mark.parametrize("sql, tables", [
+    ('SELECT * FROM forex_trades', {"forex_trades"}),
+    ('SELECT * FROM forex_trades f, forex_trades_daily d WHERE f."Symbol" = d."Symbol"',
+     {"forex_trades", "forex_trades_daily"}),
+    ('SELECT a.x FROM public.forex_trades a , "forex_trades_monthly" AS m', {"forex_trades", "forex_trades_monthly"}),
+    ('SELECT * FROM (SELECT * FROM forex_trades) t, forex_trades_daily', {"forex_trades", "forex_trades_daily"}),
+    ('WITH x AS (SELECT * FROM forex_trades) SELECT * FROM x, forex_trades_monthly m',
+     {"forex_trades", "forex_trades_monthly"}),
+    ('SELECT EXTRACT(YEAR FROM "Trade_Date") FROM forex_trades JOIN forex_trades_daily d ON true',
+     {"forex_trades", "forex_trades_daily"}),
+    ("SELECT COUNT(*) FROM forex_trades WHERE \"Notes\" = 'from a, b'", {"forex_trades"}),
+])
+def test_referenced_tables(sql, tables):
+    assert referenced_tables(sql) == tables
+
+
+@pytest.mark.parametrize("sql", [
+    'SELECT * FROM generate_series(1, 3) g, forex_trades',
+    'SELECT * FROM forex_trades f, LATERAL (SELECT 1) x',
+])
+def test_unsure_table_sources_are_uncacheable(sql):
+    assert referenced_tables(sql) == set()
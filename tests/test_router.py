@@ -0,0 +1,56 @@
+import pytest
+
+from app.services_v1 import router_core
+from app.services_v1.router_core import QueryRouter
+
+# Knowledge-base questions the keyword rules once sent straight to the SQL Agent
+KB_QUESTIONS = [
+    "How do I calculate profit and loss?",
+    "How do I copy trades from professional traders on HFM?",
+    "I have a question about one of my trades. Who should I email?",
+    "Do I need to pay taxes on profits",
+    "My phone number shows as invalid",
+]
+
+TRADING_DATA_QUESTIONS = [
+    "What's my profit?",
+    "What is my profit percentage?",
+    "What's my total loss this month?",
+    "Show me my trades",
+    "Calculate my win rate",
+    "What are my profits on EURUSD?",
+]
+
+
+@pytest.mark.parametrize("query", KB_QUESTIONS)
+def test_kb_questions_are_not_routed_to_sql(query):
+    assert QueryRouter().classify(query) != router_core.SQL
+
+
+@pytest.mark.parametrize("query", TRADING_DATA_QUESTIONS)
+def test_trading_data_questions_are_routed_to_sql(query):
+    assert QueryRouter().classify(query) == router_core.SQL
+
+
+def test_data_and_knowledge_signals_are_mixed():
+    assert QueryRouter().classify("How do I calculate my profit?") == router_core.MIXED
+
+
+def test_knowledge_questions_are_routed_to_rag():
+    assert QueryRouter().classify("What is leverage?") == router_core.RAG
+    assert QueryRouter().classify("Who should I email about withdrawals?") == router_core.RAG
+
+
+def test_keywords_match_whole_words_only():
+    assert not router_core.is_personal_query("My phone number shows as invalid")
+    assert router_core.is_personal_query("Show my losses")
+
+
+@pytest.mark.parametrize("query", ["What about GBPUSD?", "and last month?", "Why is that?", "Show them again"])
+def test_follow_ups_are_detected(query):
+    assert router_core.is_follow_up(query)
+
+
+@pytest.mark.parametrize("query", ["What's my profit this month?", "How do I verify my account?"])
+def test_self_contained_questions_are_not_follow_ups(query):
+    assert not router_core.is_follow_up(query)
@@ -0,0 +1,33 @@
+import pytest
+
+from app.services_v1.sql_plan_core import extract_slots
+from app.services_v1.sql_plan_core import parameterize
+from app.services_v1.sql_plan_core import question_template
+
+
+def plan(query, sql):
+    slots = extract_slots(query)
+    return parameterize(sql, slots, question_template(query, slots))
+
+
+def test_slot_literals_become_parameters():
+    result = plan("My top 5 trades on EUR/USD", """SELECT * FROM forex_trades WHERE "Symbol" = 'EUR/USD' LIMIT 5""")
+    assert result == {"sql": 'SELECT * FROM forex_trades WHERE "Symbol" = $1 LIMIT 5', "params": [0]}
+
+
+@pytest.mark.parametrize("query, sql", [
+    ("My total buy profit", """SELECT SUM("Daily_PnL") FROM forex_trades WHERE "Type" = 'Buy'"""),
+    ("My profit over the last 3 months",
+     """SELECT SUM(total_pnl) FROM forex_trades_monthly WHERE "Month" >= DATE_TRUNC('month', CURRENT_DATE - INTERVAL '3 months')"""),
+])
+def test_literals_from_pinned_words_and_time_units_are_kept(query, sql):
+    assert plan(query, sql) is not None
+
+
+@pytest.mark.parametrize("query, sql", [
+    ("What's my profit on gold?", """SELECT SUM(total_pnl) FROM forex_trades_monthly WHERE "Symbol" = 'XAU/USD'"""),
+    ("My profit last month", """SELECT SUM(total_pnl) FROM forex_trades_monthly WHERE "Month" = '2026-09-01'"""),
+    ("My top trades", """SELECT * FROM forex_trades ORDER BY "Daily_PnL" DESC LIMIT 7"""),
+])
+def test_literals_not_from_the_question_are_refused(query, sql):
+    assert plan(query, sql) is None
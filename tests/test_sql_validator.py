@@ -0,0 +1,38 @@
+import re
+
+import pytest
+
+from app.services_v1.sql_agent_core import SQLValidator
+from app.services_v1.sql_agent_core import instructions
+
+# A question each quick pattern in the SQL agent's instructions is meant to answer
+QUICK_PATTERN_QUESTIONS = {
+    "profit percentage": "What is my profit percentage?",
+    "total profit": "What is my total profit?",
+    "most profitable": "What was my most profitable trade?",
+    "top profitable pairs": "What are my top profitable pairs?",
+    "average": "What is my average profit per trade?",
+    "profit over time/period": "Show my profit over time",
+    "monthly breakdown": "Give me a monthly breakdown of my profit",
+    "performance over time": "Show my performance over time",
+}
+
+QUICK_PATTERNS = dict(re.findall(r'^\s*- "([^"]+)"[^→\n]*→ (SELECT .+)$', instructions, re.MULTILINE))
+
+
+def test_every_quick_pattern_has_a_question():
+    assert set(QUICK_PATTERNS) == set(QUICK_PATTERN_QUESTIONS)
+
+
+@pytest.mark.parametrize("label", sorted(QUICK_PATTERN_QUESTIONS))
+def test_quick_pattern_passes_validator(label):
+    result = SQLValidator.validate_complete(QUICK_PATTERNS[label], QUICK_PATTERN_QUESTIONS[label])
+    assert result["valid"], f"{label}: {result['error']}"
+
+
+@pytest.mark.parametrize("sql", [
+    'SELECT SUM("Daily_PnL") FROM forex_trades -- total',
+    'SELECT SUM("Daily_PnL") /* total */ FROM forex_trades',
+])
+def test_comments_are_rejected(sql):
+    assert not SQLValidator.security_check(sql)[0]